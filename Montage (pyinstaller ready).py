@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
-import os, threading, queue, pathlib
+import os, threading, pathlib, multiprocessing
 from tkinter import *
 from tkinter import ttk, filedialog
 from PIL import Image, ImageTk
-import customtkinter as ctk
-import cv2
-import numpy as np
+import montage_engine
+import montage_cache
+import montage_profile
+from montage_events import ProgressBus, describe
+from montage_scheduler import TaskScheduler
+from montage_thumbs import ThumbnailGrid, ThumbnailCache
+from montage_engine import PAGE_SIZES, make_pages
 try:
     import sys, os
 
@@ -22,110 +26,16 @@ except:
 
 
 # ---------- Config ----------
-PAGE_SIZES = {"A4": (2480,3508), "Letter": (2550,3300)}
-DPI = 300
-GRID_MARGIN = 40
-MARGIN_OUTER = 60
-INNER_CELL_MARGIN = 20
 
 # CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
 
 CASCADE_PATH = resource_path(os.path.join("haarcascade_frontalface_default.xml"))
-face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
+montage_engine.set_cascade_path(CASCADE_PATH)
 
-stop_flag = False
 DEFAULT_OUTPUT = os.path.join(pathlib.Path.home(), "Documents", "Montage")
 icon_path = resource_path("ICON.png")
 
 
-# ---------- Image Handling ----------
-def detect_faces_bbox(np_img):
-    gray = cv2.cvtColor(np_img, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30,30))
-    if len(faces)==0:
-        h,w=gray.shape
-        return int(w*0.3), int(h*0.3), int(w*0.4), int(h*0.4)
-    x1=min([x for (x,y,w,h) in faces])
-    y1=min([y for (x,y,w,h) in faces])
-    x2=max([x+w for (x,y,w,h) in faces])
-    y2=max([y+h for (x,y,w,h) in faces])
-    return x1,y1,x2-x1,y2-y1
-
-def detect_subject_bbox(np_img):
-    gray = cv2.cvtColor(np_img, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray,(7,7),0)
-    edges = cv2.Canny(blur,50,150)
-    edges = cv2.dilate(edges,np.ones((5,5),np.uint8),1)
-    contours,_ = cv2.findContours(edges,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)
-    if not contours:
-        h,w=gray.shape
-        return int(w*0.3), int(h*0.3), int(w*0.4), int(h*0.4)
-    largest = max(contours,key=cv2.contourArea)
-    x,y,w,h = cv2.boundingRect(largest)
-    return x,y,w,h
-
-def place_image_in_cell(pil_img, cell_w, cell_h):
-    if pil_img.width > pil_img.height:
-        pil_img = pil_img.rotate(90, expand=True)
-    img_w,img_h = pil_img.size
-    np_img = cv2.cvtColor(np.array(pil_img.convert("RGB")), cv2.COLOR_RGB2BGR)
-    fx,fy,fw,fh = detect_faces_bbox(np_img)
-    sx,sy,sw,sh = detect_subject_bbox(np_img)
-    x1 = min(fx,sx)
-    y1 = min(fy,sy)
-    x2 = max(fx+fw, sx+sw)
-    y2 = max(fy+fh, sy+sh)
-    bbox_cx = (x1+x2)/2
-    bbox_cy = (y1+y2)/2
-    scale = max(cell_w/img_w, cell_h/img_h)
-    new_w = int(round(img_w*scale))
-    new_h = int(round(img_h*scale))
-    pil_resized = pil_img.resize((new_w,new_h),resample=Image.LANCZOS)
-    bbox_cx *= scale
-    bbox_cy *= scale
-    max_crop_x = max(new_w - cell_w,0)
-    max_crop_y = max(new_h - cell_h,0)
-    crop_x = int(np.clip(bbox_cx - cell_w/2,0,max_crop_x))
-    crop_y = int(np.clip(bbox_cy - cell_h/2,0,max_crop_y))
-    return pil_resized.crop((crop_x,crop_y,crop_x+cell_w,crop_y+cell_h))
-
-def make_pages(task_images, page_size, rows, cols, dest_dir, progress_callback, task_index):
-    global stop_flag
-    MAX_PER_PAGE = rows * cols
-    page_w, page_h = page_size
-    TOTAL_H_MARGIN = (cols - 1) * GRID_MARGIN + 2 * MARGIN_OUTER + 2 * INNER_CELL_MARGIN * cols
-    TOTAL_V_MARGIN = (rows - 1) * GRID_MARGIN + 2 * MARGIN_OUTER + 2 * INNER_CELL_MARGIN * rows
-    CELL_W = (page_w - TOTAL_H_MARGIN)//cols
-    CELL_H = (page_h - TOTAL_V_MARGIN)//rows
-    os.makedirs(dest_dir, exist_ok=True)
-
-    for pidx in range(0, len(task_images), MAX_PER_PAGE):
-        if stop_flag: break
-        batch = task_images[pidx:pidx+MAX_PER_PAGE]
-        canvas = Image.new("RGB",(page_w,page_h),(255,255,255))
-
-        for i, img_path in enumerate(batch):
-            if stop_flag: break
-            try:
-                pil_img = Image.open(img_path).convert("RGB")
-            except:
-                continue
-
-            cell_img = place_image_in_cell(pil_img, CELL_W, CELL_H)
-            row = i // cols
-            col = i % cols
-            x = MARGIN_OUTER + col*(CELL_W + GRID_MARGIN + 2*INNER_CELL_MARGIN) + INNER_CELL_MARGIN
-            y = MARGIN_OUTER + row*(CELL_H + GRID_MARGIN + 2*INNER_CELL_MARGIN) + INNER_CELL_MARGIN
-            canvas.paste(cell_img, (int(x), int(y)))
-
-            # Update progress bar for this task
-            if progress_callback:
-                progress_callback(pidx + i + 1, len(task_images))
-
-        out_name = os.path.join(dest_dir, f"task{task_index:02d}_page_{(pidx//MAX_PER_PAGE)+1:03d}.png")
-        canvas.save(out_name, dpi=(DPI, DPI))
-
-
 def create_task_thumbnail(image_paths, size=(60, 60)):
     """
     Creates a 2x2 grid thumbnail from up to 4 images,
@@ -155,7 +65,7 @@ def create_task_thumbnail(image_paths, size=(60, 60)):
 
     for i, img_path in enumerate(image_paths[:4]):
         try:
-            img = Image.open(img_path)
+            img = montage_engine.open_for_cell(img_path, cell_w, cell_h)  # reduced decode
             cell_img = scale_and_crop(img, cell_w, cell_h)
             x, y = positions[i]
             thumb.paste(cell_img, (x, y))
@@ -187,13 +97,12 @@ class Task:
         self.cols = cols
         self.status = "Pending"
         self.subfolder_name = subfolder_name
-        self.thumbnail = None
-        if images:
-            try:
-                pil_img = Image.open(images[0])
-                pil_img.thumbnail((60,60))
-                self.thumbnail = ImageTk.PhotoImage(pil_img)
-            except: self.thumbnail = None
+        self.thumbnail = None  # composite, built by MontageGUI.update_card
+        self.card = None
+        self.token = None      # montage_engine.TaskToken of the current run
+        self.started = False
+        self.profile = None    # stage timing summary of the last run (montage_engine.PROFILE)
+        self.progress_text = ""  # images / pages / rate / ETA of the current run
 
 # ---------- GUI ----------
 class MontageGUI:
@@ -204,14 +113,18 @@ class MontageGUI:
         center_window(master)
         self.tasks=[]
         self.dest_dir=StringVar(value=DEFAULT_OUTPUT)
-        self.progress_queue=queue.Queue()
+        self.output_format=StringVar(value=montage_engine.OUTPUT_FORMAT)
+        self.events=ProgressBus()  # task threads -> UI, polled by update_progress
         self.active_task=None
         self.task_thread=None
         self.selected_task_index=None
-        self.thumbnail_cache = {}
+        self.thumbnail_cache = ThumbnailCache()
         self.task_frames = []
+        self.scheduler = TaskScheduler(dispatch=self.events.post)
         self.create_widgets()
-        self.master.after(100,self.update_progress)
+        self.master.after(self.events.interval_ms,self.update_progress)
+        # load cv2/numpy and the cascade in the background once the window is up
+        self.master.after(200, lambda: threading.Thread(target=montage_engine.warm_up, daemon=True).start())
 
 
         icon = Image.open(icon_path)              # load image with PIL
@@ -233,6 +146,7 @@ class MontageGUI:
         # Edit menu
         edit_menu = Menu(self.menu_bar, tearoff=0)
         edit_menu.add_command(label="Clear All Tasks", command=self.clear_all_tasks)
+        edit_menu.add_command(label="Clear Detection Cache", command=montage_cache.clear_cache)
         self.menu_bar.add_cascade(label="Edit", menu=edit_menu)
 
         # Help menu
@@ -243,6 +157,7 @@ class MontageGUI:
 
 
     def show_about(self):
+        import customtkinter as ctk  # only the About dialog needs it; keeps startup fast
         about_win = Toplevel(self.master)
         about_win.overrideredirect(True)  # remove top bar
         about_win.resizable(False, False)
@@ -356,10 +271,16 @@ class MontageGUI:
         ttk.Button(control_frame,text="Add Task",command=self.add_task_with_images).pack(side=LEFT, padx=5)
         ttk.Button(control_frame,text="Start All",command=self.start_all_tasks).pack(side=LEFT,padx=5)
         ttk.Button(control_frame,text="Clear All Tasks",command=self.clear_all_tasks).pack(side=LEFT,padx=5)
+        ttk.Label(control_frame,text="Format:").pack(side=LEFT)
+        ttk.Combobox(control_frame,textvariable=self.output_format,values=list(montage_engine.OUTPUT_FORMATS),width=5,state="readonly").pack(side=LEFT,padx=5)
         ttk.Entry(control_frame,textvariable=self.dest_dir,width=50).pack(side=LEFT,padx=5, fill=X, expand=True)
         ttk.Button(control_frame,text="Select Destination",command=self.select_dest).pack(side=RIGHT,padx=5)
 
         # Task cards canvas
+        # All running tasks together
+        self.overall_label = ttk.Label(self.master, anchor=W)
+        self.overall_label.pack(side=BOTTOM, fill=X, padx=10, pady=(0, 5))
+
         self.canvas_frame = Frame(self.master)
         self.canvas_frame.pack(fill=BOTH,expand=True,padx=10,pady=5)
         self.canvas = Canvas(self.canvas_frame)
@@ -375,106 +296,140 @@ class MontageGUI:
         self.canvas.bind("<Configure>", on_canvas_resize)
 
         self.cards_frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-        
-
-    # ---------- Task List Refresh ----------
-    def refresh_task_list(self):
-        for w in self.cards_frame.winfo_children():
-            w.destroy()
-        self.task_frames.clear()
-
-        for idx, task in enumerate(self.tasks):
-            frame = ttk.Frame(self.cards_frame, relief=RIDGE, borderwidth=2, padding=5)
-            frame.pack(fill=X, pady=2)
-            self.task_frames.append(frame)
-
-            # Highlight if selected
-            if self.selected_task_index == idx:
-                frame.config(style='Selected.TFrame')
-            else:
-                frame.config(style='TFrame')
-
-            # Subframes
-            subframe_image = ttk.Frame(frame)
-            subframe_info = ttk.Frame(frame)
-            subframe_buttons = ttk.Frame(frame)
-
-            # Thumbnail (or placeholder)
-            task.thumbnail = create_task_thumbnail(task.images)
-            lbl_img = Label(subframe_image, image=task.thumbnail, width=60, height=60)
-
-            lbl_img.pack(side=LEFT, padx=5)
-
-            # Per-task progress bar
-            task.progressbar = ttk.Progressbar(subframe_info, orient=HORIZONTAL, length=430, mode='determinate')
-            task.progressbar.pack(side=TOP, anchor=W, padx=5, pady=2)
-
-            if task.status == "Done":
-                task.progressbar['value'] = task.progressbar['maximum']  # optional: show full
-            else:
-                task.progressbar['value'] = 0
-                task.progressbar['maximum'] = len(task.images)
-
-            style = ttk.Style()
-            style.configure("green.Horizontal.TProgressbar", foreground='green', background='green')
-            task.progressbar.config(style="green.Horizontal.TProgressbar")
-            
-            # Info
-            dest_path = self.dest_dir.get()
-            if task.subfolder_name:
-                dest_path = os.path.join(dest_path, task.subfolder_name)
-
-            lbl_text1 = Label(subframe_info, text=(f"{len(task.images)} images | "f"{task.page_type} | "f"{task.rows}x{task.cols} | "),width=60,anchor=W,justify=LEFT,wraplength=600)
-            lbl_text1.pack(side=TOP, padx=5)
-
-            lbl_text2 = Label(subframe_info,text=(f"{dest_path} | "f"{task.status}"),width=60,anchor=W,justify=LEFT,wraplength=600)
-            lbl_text2.pack(side=TOP, padx=5)
-
-            # Buttons
-            ttk.Button(subframe_buttons, text="Edit", command=lambda i=idx: self.edit_task(i)).pack(side=LEFT, padx=5)
-            ttk.Button(subframe_buttons, text="Remove", command=lambda i=idx: self.remove_task(i)).pack(side=LEFT, padx=5)
-            if task.status == "Done":
-                btn_text = "Open Folder"
-                btn_command = lambda t=task: self.open_task_dir(t, self.dest_dir.get())
-            else:
-                btn_text = "Start"
-                btn_command = lambda i=idx: self.run_task(i)
 
-            start_btn = ttk.Button(subframe_buttons, text=btn_text, command=btn_command)
-            start_btn.pack(side=LEFT, padx=5)
-            task.start_btn = start_btn
+        def _bind_mousewheel(widget):
+            if os.name == 'nt':          # Windows
+                widget.bind_all("<MouseWheel>", lambda e: widget.yview_scroll(int(-1*(e.delta/120)), "units"))
+            elif os.name == 'mac':       # macOS (rarely 'mac' — safer to check platform if you need)
+                widget.bind_all("<MouseWheel>", lambda e: widget.yview_scroll(int(-1*e.delta), "units"))
+            else:                        # Linux/others (X11)
+                widget.bind_all("<Button-4>", lambda e: widget.yview_scroll(-1, "units"))
+                widget.bind_all("<Button-5>", lambda e: widget.yview_scroll(1, "units"))
 
+        # bind mouse wheel only while pointer is over the canvas (prevents global interference)
+        def _on_enter(e):
+            _bind_mousewheel(self.canvas)
+        def _on_leave(e):
+            try:
+                self.canvas.unbind_all("<MouseWheel>")
+                self.canvas.unbind_all("<Button-4>")
+                self.canvas.unbind_all("<Button-5>")
+            except Exception:
+                pass
 
+        self.canvas.bind("<Enter>", _on_enter)
+        self.canvas.bind("<Leave>", _on_leave)
 
-            # pack subframes
-            subframe_image.pack(side=LEFT)
-            subframe_info.pack(side=LEFT)
-            subframe_buttons.pack(side=RIGHT)
+        # destination shows on every card
+        self.dest_dir.trace_add("write", lambda *args: [self.update_card(t) for t in self.tasks])
 
 
-            def _bind_mousewheel(widget):
-                if os.name == 'nt':          # Windows
-                    widget.bind_all("<MouseWheel>", lambda e: widget.yview_scroll(int(-1*(e.delta/120)), "units"))
-                elif os.name == 'mac':       # macOS (rarely 'mac' — safer to check platform if you need)
-                    widget.bind_all("<MouseWheel>", lambda e: widget.yview_scroll(int(-1*e.delta), "units"))
-                else:                        # Linux/others (X11)
-                    widget.bind_all("<Button-4>", lambda e: widget.yview_scroll(-1, "units"))
-                    widget.bind_all("<Button-5>", lambda e: widget.yview_scroll(1, "units"))
+    # ---------- Task List Refresh ----------
+    def refresh_task_list(self):
+        """
+        Syncs the cards with self.tasks: builds cards for new tasks, destroys
+        cards of removed ones and updates the rest in place.
+        """
+        for frame in self.task_frames:
+            if frame.task not in self.tasks:
+                frame.destroy()
+                frame.task.card = None
+
+        order = []
+        for idx, task in enumerate(self.tasks):
+            if getattr(task, "card", None) is None:
+                self.build_card(task)
+            self.update_card(task)
 
+            # Highlight if selected
+            task.card.config(style='Selected.TFrame' if self.selected_task_index == idx else 'TFrame')
+            order.append(task.card)
+
+        # Re-stack only when tasks were added, removed or reordered
+        if order != self.task_frames:
+            for frame in order:
+                frame.pack_forget()
+            for frame in order:
+                frame.pack(fill=X, pady=2)
+        self.task_frames = order
+
+    def build_card(self, task):
+        frame = ttk.Frame(self.cards_frame, relief=RIDGE, borderwidth=2, padding=5)
+        frame.task = task
+        task.card = frame
+        task.thumb_key = None
+
+        # Subframes
+        subframe_image = ttk.Frame(frame)
+        subframe_info = ttk.Frame(frame)
+        subframe_buttons = ttk.Frame(frame)
+
+        # Thumbnail (filled in by update_card)
+        task.lbl_img = Label(subframe_image, width=60, height=60)
+        task.lbl_img.pack(side=LEFT, padx=5)
+
+        # Per-task progress bar
+        task.progressbar = ttk.Progressbar(subframe_info, orient=HORIZONTAL, length=430, mode='determinate', style="green.Horizontal.TProgressbar")
+        task.progressbar.pack(side=TOP, anchor=W, padx=5, pady=2)
+        task.progressbar['maximum'] = len(task.images)
+
+        # Info
+        task.lbl_text1 = Label(subframe_info, width=60, anchor=W, justify=LEFT, wraplength=600)
+        task.lbl_text1.pack(side=TOP, padx=5)
+        task.lbl_text2 = Label(subframe_info, width=60, anchor=W, justify=LEFT, wraplength=600)
+        task.lbl_text2.pack(side=TOP, padx=5)
+
+        # Buttons (look the task up by identity, indexes shift when tasks are removed)
+        task.edit_btn = ttk.Button(subframe_buttons, text="Edit", command=lambda t=task: self.edit_task(self.tasks.index(t)))
+        task.edit_btn.pack(side=LEFT, padx=5)
+        ttk.Button(subframe_buttons, text="Remove", command=lambda t=task: self.remove_task(self.tasks.index(t))).pack(side=LEFT, padx=5)
+        task.start_btn = ttk.Button(subframe_buttons)
+        task.start_btn.pack(side=LEFT, padx=5)
+        task.pause_btn = ttk.Button(subframe_buttons, text="Pause", command=lambda t=task: self.toggle_pause(t))
+        task.pause_btn.pack(side=LEFT, padx=5)
+        task.cancel_btn = ttk.Button(subframe_buttons, text="Cancel", command=lambda t=task: self.cancel_task(t))
+        task.cancel_btn.pack(side=LEFT, padx=5)
+
+        # pack subframes
+        subframe_image.pack(side=LEFT)
+        subframe_info.pack(side=LEFT)
+        subframe_buttons.pack(side=RIGHT)
+
+    def update_card(self, task):
+        """Refreshes one card from its task; the composite thumbnail is only rebuilt when the images change."""
+        if getattr(task, "card", None) is None:
+            return
+        thumb_key = tuple(task.images[:4])
+        if task.thumb_key != thumb_key:
+            task.thumbnail = create_task_thumbnail(task.images)
+            task.thumb_key = thumb_key
+            task.lbl_img.config(image=task.thumbnail)
 
-            # bind mouse wheel only while pointer is over the canvas (prevents global interference)
-            def _on_enter(e):
-                _bind_mousewheel(self.canvas)
-            def _on_leave(e):
-                try:
-                    self.canvas.unbind_all("<MouseWheel>")
-                    self.canvas.unbind_all("<Button-4>")
-                    self.canvas.unbind_all("<Button-5>")
-                except Exception:
-                    pass
+        if task.status == "Done":
+            task.progressbar['value'] = task.progressbar['maximum']  # optional: show full
+        elif task.status not in ("Processing", "Paused"):
+            task.progressbar['value'] = 0
+            task.progressbar['maximum'] = len(task.images)
 
-            self.canvas.bind("<Enter>", _on_enter)
-            self.canvas.bind("<Leave>", _on_leave)
+        dest_path = self.dest_dir.get()
+        if task.subfolder_name:
+            dest_path = os.path.join(dest_path, task.subfolder_name)
+        task.lbl_text1.config(text=(f"{len(task.images)} images | "f"{task.page_type} | "f"{task.rows}x{task.cols} | "))
+        status = task.status
+        if task.progress_text and task.status in ("Processing", "Paused"):
+            status += f" | {task.progress_text}"
+        task.lbl_text2.config(text=(f"{dest_path} | "f"{status}") + (f" | {task.profile}" if task.profile else ""))
+
+        active = task.status in ("Queued", "Processing", "Paused")
+        task.pause_btn.config(text="Resume" if task.status == "Paused" else "Pause", state=NORMAL if active else DISABLED)
+        task.cancel_btn.config(state=NORMAL if active else DISABLED)
+        # a run owns the task (its token, destination and manifest) until it ends
+        task.edit_btn.config(state=DISABLED if active or task.status == "Cancelling" else NORMAL)
+
+        if task.status == "Done":
+            task.start_btn.config(text="Open Folder", command=lambda t=task: self.open_task_dir(t, self.dest_dir.get()))
+        else:
+            task.start_btn.config(text="Start", command=lambda t=task: self.run_task(self.tasks.index(t)))
 
 
     def select_task(self,index):
@@ -489,30 +444,19 @@ class MontageGUI:
             self.run_task(self.selected_task_index)
 
     def start_all_tasks(self):
-        # Disable the button while processing
-
-        def run_all():
-            for idx, task in enumerate(self.tasks):
-                if task.status == "Done":
-                    continue  # skip finished tasks
-                task.status = "Processing"
-                self.refresh_task_list()
-                self.run_task(idx)
-
-                # Wait until this task finishes
-                while task.status == "Processing":
-                    self.master.update()
-            
-
-        threading.Thread(target=run_all, daemon=True).start()
+        for idx, task in enumerate(self.tasks):
+            if task.status == "Done":
+                continue  # skip finished tasks
+            self.run_task(idx, priority=1)  # queued behind tasks started individually
 
 
     def clear_all_tasks(self):
-        global stop_flag
-        # stop_flag=True
+        for task in self.tasks:
+            if task.token:
+                task.token.cancel()
+        self.scheduler.cancel_pending()
         self.tasks.clear()
         self.refresh_task_list()
-        # self.progress['value']=0
 
     def select_dest(self):
         directory = filedialog.askdirectory()
@@ -520,10 +464,17 @@ class MontageGUI:
             self.dest_dir.set(directory)
 
     # ---------- Run Task ----------
-    def run_task(self, index):
+    def run_task(self, index, priority=0):
         task = self.tasks[index]
-        task.status = "Processing"
-        self.refresh_task_list()
+        if task.status in ("Queued", "Processing", "Paused", "Cancelling"):
+            return
+        task.status = "Queued"
+        task.started = False
+        task.token = token = montage_engine.TaskToken()
+        task.profile = None
+        task.progress_text = ""
+        profiler = montage_profile.Profiler() if montage_engine.PROFILE else None
+        self.update_card(task)
 
         page_size = PAGE_SIZES.get(task.page_type, PAGE_SIZES["A4"])
 
@@ -533,36 +484,51 @@ class MontageGUI:
             # sanitize/normalize just in case
             dest_dir = os.path.join(dest_dir, os.path.basename(task.subfolder_name))
 
-        # progress callback to safely update the GUI progressbar
+        # progress goes through the event bus; the UI picks it up at most POLL_HZ times a second
         def progress_callback(current, total):
-            # update in main thread
-            self.master.after(0, lambda: task.progressbar.config(value=current, maximum=total))
+            self.events.images(task, current, total)
 
-        # worker function
-        def worker():
-            try:
-                make_pages(task.images, page_size, task.rows, task.cols, dest_dir, progress_callback, index + 1)
-            finally:
-                # on finish, update status and clear progress in main thread
-                def finish_updates():
-                    task.status = "Done"
-                    try:
-                        task.progressbar.config(value=0)
-                    except Exception:
-                        pass
-                    self.refresh_task_list()
+        def pages_callback(done, total):
+            self.events.pages(task, done, total)
 
-                    # Update button to "Open Folder" if task has subfolder
-                    if hasattr(task, 'start_btn'):
-                        task.start_btn.config(
-                            text="Open Folder",
-                            command=lambda t=task, d=self.dest_dir.get(): self.open_task_dir(t, d)
-                        )
+        def on_start():
+            if token.cancelled:
+                return
+            task.started = True
+            task.status = "Paused" if token.paused else "Processing"
+            self.update_card(task)
 
+        fmt = self.output_format.get()
 
-                self.master.after(0, finish_updates)
+        # worker function, run by the scheduler
+        def job():
+            self.events.start(task, len(task.images))
+            try:
+                make_pages(task.images, page_size, task.rows, task.cols, dest_dir, progress_callback, index + 1, fmt=fmt,
+                           token=token, profiler=profiler, pages_callback=pages_callback)
+            finally:
+                self.events.finish(task)
+                if profiler:
+                    try:
+                        profiler.write(os.path.join(dest_dir, f"task{index + 1:02d}.trace.json"))
+                    except OSError as e:
+                        print(f"Could not write the trace: {e}")
+
+        # on finish, update status and clear progress (dispatched to the main thread)
+        def finish_updates(result, error):
+            if isinstance(error, montage_engine.TaskCancelled):
+                task.status = "Cancelled"
+            else:
+                task.status = "Done" if error is None else "Failed"
+            if profiler:
+                task.profile = profiler.summary_text()
+            try:
+                task.progressbar.config(value=0)
+            except Exception:
+                pass
+            self.update_card(task)  # switches Start to "Open Folder" when done
 
-        threading.Thread(target=worker, daemon=True).start()
+        self.scheduler.submit(job, priority, on_start=on_start, on_done=finish_updates)
 
 
     # ---------- Intermediate Window ----------
@@ -606,58 +572,9 @@ class MontageGUI:
         entry_subfolder.pack(anchor=W, padx=20)
         entry_subfolder.configure(state=DISABLED)
 
-                # --- Thumbnails (fixed scrollbar position) ---
-        # container to hold canvas + scrollbar so scrollbar stays next to canvas
-        thumb_container = ttk.Frame(win)
-        thumb_container.pack(fill=BOTH, expand=True, padx=5, pady=5)
-
-        thumb_canvas = Canvas(thumb_container, height=250)
-        thumb_canvas.pack(side=LEFT, fill=BOTH, expand=True)
-
-        thumb_scrollbar = ttk.Scrollbar(thumb_container, orient=VERTICAL, command=thumb_canvas.yview)
-        thumb_scrollbar.pack(side=RIGHT, fill=Y)
-
-        thumb_canvas.configure(yscrollcommand=thumb_scrollbar.set)
-
-        thumb_frame = ttk.Frame(thumb_canvas)
-        thumb_window = thumb_canvas.create_window((0, 0), window=thumb_frame, anchor='nw')
-
-        # keep canvas scrollregion up-to-date when inner frame changes
-        def _on_frame_configure(event):
-            thumb_canvas.configure(scrollregion=thumb_canvas.bbox("all"))
-        thumb_frame.bind("<Configure>", _on_frame_configure)
-
-        # make the inner frame match canvas width (so widgets wrap correctly)
-        def _on_canvas_configure(event):
-            thumb_canvas.itemconfig(thumb_window, width=event.width)
-        thumb_canvas.bind("<Configure>", _on_canvas_configure)
-
-        # optional: mouse wheel scrolling when pointer is over the canvas
-        def _bind_mousewheel(widget):
-            if os.name == 'nt':          # Windows
-                widget.bind_all("<MouseWheel>", lambda e: widget.yview_scroll(int(-1*(e.delta/120)), "units"))
-            elif os.name == 'mac':       # macOS (rarely 'mac' — safer to check platform if you need)
-                widget.bind_all("<MouseWheel>", lambda e: widget.yview_scroll(int(-1*e.delta), "units"))
-            else:                        # Linux/others (X11)
-                widget.bind_all("<Button-4>", lambda e: widget.yview_scroll(-1, "units"))
-                widget.bind_all("<Button-5>", lambda e: widget.yview_scroll(1, "units"))
-
-        # bind mouse wheel only while pointer is over the canvas (prevents global interference)
-        def _on_enter(e):
-            _bind_mousewheel(thumb_canvas)
-        def _on_leave(e):
-            try:
-                thumb_canvas.unbind_all("<MouseWheel>")
-                thumb_canvas.unbind_all("<Button-4>")
-                thumb_canvas.unbind_all("<Button-5>")
-            except Exception:
-                pass
-
-        thumb_canvas.bind("<Enter>", _on_enter)
-        thumb_canvas.bind("<Leave>", _on_leave)
-
-        # finally populate thumbnails
-        self.refresh_thumbnails(images, selected_indices, thumb_frame)
+        # --- Thumbnails (decoded in the background, only visible rows are widgets) ---
+        thumb_grid = ThumbnailGrid(win, images, selected_indices, self.thumbnail_cache, height=250)
+        thumb_grid.pack(fill=BOTH, expand=True, padx=5, pady=5)
 
 
         from datetime import datetime
@@ -682,44 +599,15 @@ class MontageGUI:
 
         btn_frame = ttk.Frame(win)
         btn_frame.pack(side=BOTTOM,pady=5)
-        ttk.Button(btn_frame,text="Add Images",command=lambda:self.add_images(images,selected_indices,thumb_frame)).pack(side=LEFT,padx=5)
+        ttk.Button(btn_frame,text="Add Images",command=lambda:self.add_images(images,selected_indices,thumb_grid)).pack(side=LEFT,padx=5)
         ttk.Button(btn_frame,text="Add Task",command=add_task_final).pack(side=LEFT,padx=5)
 
     # ---------- Thumbnail Management ----------
-    def refresh_thumbnails(self, images, selected_indices, frame):
-        for w in frame.winfo_children(): w.destroy()
-        for idx, img_path in enumerate(images):
-            try:
-                if img_path not in self.thumbnail_cache:
-                    pil_img = Image.open(img_path)
-                    pil_img.thumbnail((80, 80))
-                    self.thumbnail_cache[img_path] = ImageTk.PhotoImage(pil_img)
-                tkimg = self.thumbnail_cache[img_path]
-                
-                # Image label
-                lbl = Label(frame, image=tkimg, relief=RIDGE, borderwidth=2)
-                lbl.image = tkimg
-                lbl.grid(row=idx//6, column=idx%6, padx=2, pady=2)
-
-                # Selection border
-                def on_click(event, ix=idx):
-                    selected_indices.clear()
-                    selected_indices.add(ix)
-                    self.refresh_thumbnails(images, selected_indices, frame)
-                lbl.bind("<Button-1>", on_click)
-                if idx in selected_indices:
-                    lbl.config(relief=SUNKEN, highlightbackground="red", highlightthickness=3)
-
-                # Cross button
-                btn = Button(frame, text="✕", command=lambda ix=idx: self.remove_image(ix, images, selected_indices, frame))
-                btn.place(in_=lbl, relx=1, rely=0, anchor="ne")
-
-            except: continue
-
-    def remove_image(self, idx, images, selected_indices, frame):
-        images.pop(idx)
-        selected_indices.clear()
-        self.refresh_thumbnails(images, selected_indices, frame)
+    def refresh_thumbnails(self, images, selected_indices, grid):
+        grid.refresh()
+
+    def remove_image(self, idx, images, selected_indices, grid):
+        grid.remove(idx)
 
 
 
@@ -731,21 +619,23 @@ class MontageGUI:
             selected_indices.add(index)
             label.config(relief=RAISED)
 
-    def add_images(self,images,selected_indices,frame):
+    def add_images(self,images,selected_indices,grid):
         files = filedialog.askopenfilenames(filetypes=[("Images","*.png *.jpg *.jpeg")])
         if files:
             images.extend(files)
-            self.refresh_thumbnails(images,selected_indices,frame)
+            self.refresh_thumbnails(images,selected_indices,grid)
 
-    def remove_selected_image(self,images,selected_indices,frame):
+    def remove_selected_image(self,images,selected_indices,grid):
         for idx in sorted(selected_indices,reverse=True):
             if idx<len(images):
                 images.pop(idx)
         selected_indices.clear()
-        self.refresh_thumbnails(images,selected_indices,frame)
+        self.refresh_thumbnails(images,selected_indices,grid)
 
     def edit_task(self, index):
         task = self.tasks[index]
+        if task.status in ("Queued", "Processing", "Paused", "Cancelling"):
+            return  # cancel it (and let it stop) first
         images = list(task.images)
         selected_indices=set()
         win = Toplevel(self.master)
@@ -799,18 +689,14 @@ class MontageGUI:
 
 
         # Thumbnails
-        thumb_canvas = Canvas(win,height=250)
-        thumb_canvas.pack(fill=BOTH,expand=True,padx=5,pady=5)
-        scrollbar = ttk.Scrollbar(win, orient=VERTICAL, command=thumb_canvas.yview)
-        scrollbar.pack(side=RIGHT, fill=Y)
-        thumb_canvas.configure(yscrollcommand=scrollbar.set)
-        thumb_frame = ttk.Frame(thumb_canvas)
-        thumb_canvas.create_window((0,0),window=thumb_frame,anchor='nw')
-        thumb_frame.bind("<Configure>", lambda e: thumb_canvas.configure(scrollregion=thumb_canvas.bbox("all")))
-        self.refresh_thumbnails(images,selected_indices,thumb_frame)
+        thumb_grid = ThumbnailGrid(win, images, selected_indices, self.thumbnail_cache, height=250)
+        thumb_grid.pack(fill=BOTH, expand=True, padx=5, pady=5)
 
 
         def save_changes():
+            if task.status in ("Queued", "Processing", "Paused", "Cancelling"):
+                win.destroy()  # started while the dialog was open
+                return
             task.images = list(images)
             task.page_type = page_type_var.get()
             task.rows = rows_var.get()
@@ -822,15 +708,6 @@ class MontageGUI:
                 task.progressbar['value'] = 0
                 task.progressbar['maximum'] = len(task.images)
 
-            # Handle thumbnail
-            if task.images:
-                try:
-                    pil_img = Image.open(task.images[0])
-                    pil_img.thumbnail((60,60))
-                    task.thumbnail = ImageTk.PhotoImage(pil_img)
-                except:
-                    task.thumbnail = None
-
             # Handle subfolder logic
             if subfolder_var.get() == "1":
                 entered_name = entry_subfolder.get().strip()
@@ -853,32 +730,60 @@ class MontageGUI:
 
         btn_frame = ttk.Frame(win)
         btn_frame.pack(side=BOTTOM,pady=5)
-        ttk.Button(btn_frame,text="Add Images",command=lambda:self.add_images(images,selected_indices,thumb_frame)).pack(side=LEFT,padx=5)
+        ttk.Button(btn_frame,text="Add Images",command=lambda:self.add_images(images,selected_indices,thumb_grid)).pack(side=LEFT,padx=5)
         ttk.Button(btn_frame,text="Save Task",command=save_changes).pack(side=LEFT,padx=5)
 
     def remove_task(self, index):
-        self.tasks.pop(index)
+        task = self.tasks.pop(index)
+        if task.token:
+            task.token.cancel()
         self.refresh_task_list()
 
+    # ---------- Pause / Cancel ----------
+    def toggle_pause(self, task):
+        if not task.token or task.status not in ("Queued", "Processing", "Paused"):
+            return
+        if task.token.paused:
+            task.token.resume()
+            task.status = "Processing" if task.started else "Queued"
+        else:
+            task.token.pause()  # takes effect at the next cell
+            task.status = "Paused"
+        self.update_card(task)
+
+    def cancel_task(self, task):
+        if not task.token or task.status not in ("Queued", "Processing", "Paused"):
+            return
+        task.token.cancel()  # its queued cells leave the render pool right away
+        task.status = "Cancelling"
+        self.update_card(task)
+
 
     # ---------- Progress ----------
     def update_progress(self):
-        try:
-            while True:
-                msg,val = self.progress_queue.get_nowait()
-                if msg=="Processing":
-                    cur,total = val
-                    self.progress['maximum']=total
-                    self.progress['value']=cur
-                elif msg=="PageSaved":
-                    pass
-                elif msg=="Done":
-                    self.progress['value']=0
-        except queue.Empty:
-            pass
-        self.master.after(100,self.update_progress)
+        """Applies what the task threads posted since the last poll: callbacks first, then one update per task."""
+        calls, snapshots, overall = self.events.poll()
+        for fn in calls:
+            # callback posted from a worker thread (see TaskScheduler)
+            try:
+                fn()
+            except Exception as e:
+                print(f"Callback failed: {e}")
+        for task, snapshot in snapshots.items():
+            if task.card is None or task.status not in ("Processing", "Paused"):
+                continue
+            task.progress_text = describe(snapshot)
+            task.progressbar.config(value=snapshot["images_done"], maximum=max(1, snapshot["images_total"]))
+            self.update_card(task)
+        if overall is None:
+            self.overall_label.config(text="")
+        else:
+            tasks = "1 task" if overall["tasks"] == 1 else f"{overall['tasks']} tasks"
+            self.overall_label.config(text=f"{tasks} running | {describe(overall)}")
+        self.master.after(self.events.interval_ms, self.update_progress)
 
 if __name__=="__main__":
+    multiprocessing.freeze_support()
     root=Tk()
     MontageGUI(root)
     center_window(root)
@@ -0,0 +1,817 @@
+#!/usr/bin/env python3
+"""
+montage_bench.py
+
+Benchmarks for the montage engine.
+
+  python montage_bench.py proxy [images...] [--max-side 1024]
+  python montage_bench.py decode [images...]
+  python montage_bench.py crop [images...] [--cell 1100x1614]
+  python montage_bench.py startup [--repeat 5]
+  python montage_bench.py thumbs [images...]
+  python montage_bench.py formats [images...] [--pages 8]
+  python montage_bench.py cellpath [images...] [--cell 1100x1614]
+  python montage_bench.py detectors [images...] [--yunet-model face_detection_yunet_2023mar.onnx]
+  python montage_bench.py subject [images...] [--max-side 1024]
+  python montage_bench.py suite [--quick] [--json-out results.json] [--compare old.json]
+
+With no images given, a synthetic set is generated in a temp folder. The suite
+always generates its own sets (sizes, formats, face counts) and runs every case
+in a fresh interpreter.
+"""
+
+import io
+import os
+import sys
+import platform
+import glob
+import math
+import time
+import json
+import struct
+import argparse
+import tempfile
+import subprocess
+import statistics
+from PIL import Image
+import cv2
+import numpy as np
+
+import montage_engine as engine
+import montage_thumbs as thumbs
+from montage_layout import parse_grid, page_count
+from montage_profile import Profiler
+
+IMAGE_EXTS = ("*.jpg", "*.jpeg", "*.png", "*.tif", "*.tiff", "*.bmp", "*.webp")
+A4_2x2_CELL = (1100, 1614)
+
+
+def expand_inputs(inputs):
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for ext in IMAGE_EXTS:
+                files.extend(glob.glob(os.path.join(item, ext)))
+        else:
+            files.extend(glob.glob(item) or [item])
+    return sorted(set(files))
+
+
+def draw_face(img, cx, cy, r):
+    """
+    A shaded frontal face of radius r: dark eye sockets, brows and mouth on a
+    light oval, blurred so the Haar cascade picks it up like a photographed one.
+    """
+    h, w = img.shape[:2]
+    x0, y0, x1, y1 = max(0, cx - r), max(0, cy - r), min(w, cx + r), min(h, cy + int(r*1.2))
+    cx, cy = cx - x0, cy - y0
+    roi = img[y0:y1, x0:x1]
+    face = np.zeros(roi.shape[:2], np.float32)
+    cv2.ellipse(face, (cx, cy + int(r*0.1)), (int(r*0.75), r), 0, 0, 360, 1.0, -1)
+    shade = np.ones_like(face)
+    for dx in (-1, 1):
+        ex, ey = cx + dx*int(r*0.32), cy - int(r*0.12)
+        cv2.ellipse(shade, (ex, ey), (int(r*0.22), int(r*0.12)), 0, 0, 360, 0.35, -1)
+        cv2.ellipse(shade, (ex, ey - int(r*0.24)), (int(r*0.24), int(r*0.05)), 0, 0, 360, 0.3, -1)
+    cv2.ellipse(shade, (cx, cy + int(r*0.55)), (int(r*0.28), int(r*0.07)), 0, 0, 360, 0.4, -1)
+    cv2.ellipse(shade, (cx, cy + int(r*0.32)), (int(r*0.12), int(r*0.06)), 0, 0, 360, 0.6, -1)
+    k = max(3, int(r*0.12)) | 1
+    shade = cv2.GaussianBlur(shade, (k, k), 0)
+    mask = cv2.GaussianBlur(face, (k, k), 0)[..., None]
+    skin = np.array([150, 175, 215], np.float32) * shade[..., None]
+    roi[:] = (roi * (1 - mask) + skin * mask).astype(np.uint8)
+
+
+def synthetic_images(out_dir, count=6, size=(6000, 4000), ext=".jpg", seed=0, faces=0):
+    """Noisy backgrounds with a few solid blocks and `faces` faces, alternating landscape/portrait."""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        w, h = size if i % 2 == 0 else size[::-1]
+        img = np.full((h, w, 3), rng.integers(90, 200, 3), np.uint8)
+        img = cv2.add(img, rng.integers(0, 24, (h, w, 3), dtype=np.uint8))
+        for _ in range(5):
+            bw, bh = int(rng.integers(w//20, w//6)), int(rng.integers(h//20, h//6))
+            x, y = int(rng.integers(0, w-bw)), int(rng.integers(0, h-bh))
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            cv2.rectangle(img, (x, y), (x+bw, y+bh), color, -1)
+        for _ in range(faces):
+            r = int(rng.integers(min(w, h)//14, min(w, h)//7))
+            draw_face(img, int(rng.integers(r, w-r)), int(rng.integers(r, h-int(r*1.2))), r)
+        path = os.path.join(out_dir, f"synthetic_{i:03d}{ext}")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def with_exif_thumbnail(path, size=(160, 120)):
+    """Re-saves a JPEG with a camera-style 160x120 (or 120x160) thumbnail in EXIF IFD1."""
+    pil_img = Image.open(path)
+    thumb = pil_img.copy()
+    thumb.thumbnail(size if pil_img.width >= pil_img.height else size[::-1])
+    buf = io.BytesIO()
+    thumb.save(buf, "JPEG", quality=80)
+    data = buf.getvalue()
+    # TIFF header, IFD0 with just Orientation, IFD1 pointing at the thumbnail
+    ifd0 = struct.pack(">H", 1) + struct.pack(">HHIHH", 0x0112, 3, 1, 1, 0) + struct.pack(">I", 26)
+    ifd1 = (struct.pack(">H", 2) + struct.pack(">HHII", 0x0201, 4, 1, 26 + 30)
+            + struct.pack(">HHII", 0x0202, 4, 1, len(data)) + struct.pack(">I", 0))
+    tiff = b"MM\x00\x2a" + struct.pack(">I", 8) + ifd0 + ifd1 + data
+    pil_img.save(path, "JPEG", quality=90, exif=b"Exif\x00\x00" + tiff)
+
+
+def load_bgr(path):
+    pil_img = Image.open(path).convert("RGB")
+    if pil_img.width > pil_img.height:
+        pil_img = pil_img.rotate(90, expand=True)
+    return cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+
+
+def parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (q in 0..100) of a non-empty list."""
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(len(values) * q / 100) - 1))]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far in MB, or None where it can't be read."""
+    try:
+        # Linux: unlike ru_maxrss, VmHWM doesn't start from the parent's peak after fork/exec
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in ("PeakWorkingSetSize", "WorkingSetSize",
+                        "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                        "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+        counters = Counters(cb=ctypes.sizeof(Counters))
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 2**20
+    except (ImportError, AttributeError, OSError):
+        return None
+
+
+# ---------- Single-image helpers ----------
+# The engine detects and renders in batches (render_cells); these are the
+# one-image forms the older benchmarks compare against.
+def upright(pil_img):
+    """Landscape images turned to portrait, as the engine places them."""
+    if pil_img.width > pil_img.height:
+        pil_img = pil_img.rotate(90, expand=True)
+    return pil_img
+
+
+def detection_proxy(np_img, max_side=engine.DETECT_MAX_SIDE):
+    """
+    Downscales np_img so its longest side is at most max_side.
+    Returns (proxy, sx, sy) where sx/sy map proxy coordinates back to np_img.
+    """
+    h, w = np_img.shape[:2]
+    if not max_side or max(w, h) <= max_side:
+        return np_img, 1.0, 1.0
+    f = max_side / max(w, h)
+    pw, ph = max(1, int(round(w*f))), max(1, int(round(h*f)))
+    proxy = cv2.resize(np_img, (pw, ph), interpolation=cv2.INTER_AREA)
+    return proxy, w/pw, h/ph
+
+
+def detect_combined_bbox(np_img, max_side=engine.DETECT_MAX_SIDE):
+    """Union of the face and subject boxes as (x1, y1, x2, y2) in np_img (BGR or gray) coordinates."""
+    detector = engine.get_face_detector()
+    proxy, sx, sy = detection_proxy(np_img, max_side)
+    gray = proxy if proxy.ndim == 2 else cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY)
+    image = gray
+    if detector.needs_color:
+        image = proxy if proxy.ndim == 3 else cv2.cvtColor(proxy, cv2.COLOR_GRAY2BGR)
+    return engine.combined_bbox(gray, detector.detect(image), sx, sy)
+
+
+def render_cell(path, cell_w, cell_h, max_side=engine.DETECT_MAX_SIDE):
+    """One image through the engine's batched path. None if the file can't be opened."""
+    return engine.render_cells([(path, cell_w, cell_h)], max_side)[0]
+
+
+# ---------- Benchmarks ----------
+def bench_proxy(files, max_side, cell):
+    """Full-resolution vs proxy detection: time per image and crop drift in cell pixels."""
+    cell_w, cell_h = cell
+    full_times, proxy_times, drifts = [], [], []
+    print(f"{'image':<32}{'size':>12}{'full s':>9}{'proxy s':>9}{'drift px':>10}")
+    for path in files:
+        np_img = load_bgr(path)
+        h, w = np_img.shape[:2]
+        full_bbox, t_full = timed(detect_combined_bbox, np_img, None)
+        proxy_bbox, t_proxy = timed(detect_combined_bbox, np_img, max_side)
+        _, _, fx, fy = engine.crop_window(w, h, full_bbox, cell_w, cell_h)
+        _, _, px, py = engine.crop_window(w, h, proxy_bbox, cell_w, cell_h)
+        drift = max(abs(fx-px), abs(fy-py))
+        full_times.append(t_full)
+        proxy_times.append(t_proxy)
+        drifts.append(drift)
+        print(f"{os.path.basename(path)[:31]:<32}{f'{w}x{h}':>12}{t_full:>9.3f}{t_proxy:>9.3f}{drift:>10}")
+    full, proxy = sum(full_times), sum(proxy_times)
+    print(f"\ndetection total: full {full:.2f}s, proxy {proxy:.2f}s, speedup x{full/max(proxy, 1e-9):.1f}")
+    print(f"crop drift (cell px): median {statistics.median(drifts)}, max {max(drifts)}")
+
+
+def bench_decode(files, cell):
+    """Full decode vs cell-sized draft decode: time, decoded size and output difference."""
+    cell_w, cell_h = cell
+    full_times, draft_times, full_bytes, draft_bytes = [], [], [], []
+    print(f"{'image':<32}{'full s':>9}{'draft s':>9}{'full MB':>9}{'draft MB':>9}{'mean diff':>11}")
+    for path in files:
+        full, t_full = timed(lambda: Image.open(path).convert("RGB"))
+        draft, t_draft = timed(engine.open_for_cell, path, cell_w, cell_h)
+        a = np.asarray(engine.place_image_in_cell(full, cell_w, cell_h), np.int16)
+        b = np.asarray(engine.place_image_in_cell(draft, cell_w, cell_h), np.int16)
+        diff = np.abs(a-b)
+        full_times.append(t_full)
+        draft_times.append(t_draft)
+        full_bytes.append(full.width*full.height*3)
+        draft_bytes.append(draft.width*draft.height*3)
+        print(f"{os.path.basename(path)[:31]:<32}{t_full:>9.3f}{t_draft:>9.3f}"
+              f"{full_bytes[-1]/2**20:>9.1f}{draft_bytes[-1]/2**20:>9.1f}{diff.mean():>11.2f}")
+    print(f"\ndecode total: full {sum(full_times):.2f}s, draft {sum(draft_times):.2f}s, "
+          f"speedup x{sum(full_times)/max(sum(draft_times), 1e-9):.1f}")
+    print(f"peak decoded buffer: full {max(full_bytes)/2**20:.1f} MB, draft {max(draft_bytes)/2**20:.1f} MB")
+
+
+def bench_crop(files, cell):
+    """Resize-then-crop vs crop-before-resize: time, intermediate buffer and output difference."""
+    cell_w, cell_h = cell
+    old_times, new_times, old_bytes = [], [], []
+    print(f"{'image':<32}{'old s':>9}{'new s':>9}{'old MB':>9}{'new MB':>9}{'max diff':>10}")
+    for path in files:
+        pil_img = upright(engine.open_for_cell(path, cell_w, cell_h))
+        bbox = detect_combined_bbox(cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR))
+        new_w, new_h, crop_x, crop_y = engine.crop_window(*pil_img.size, bbox, cell_w, cell_h)
+
+        def resize_then_crop():
+            resized = pil_img.resize((new_w, new_h), resample=Image.LANCZOS)
+            return resized.crop((crop_x, crop_y, crop_x+cell_w, crop_y+cell_h))
+
+        old, t_old = timed(resize_then_crop)
+        new, t_new = timed(engine.place_image_in_cell, pil_img, cell_w, cell_h, None, bbox)
+        diff = np.abs(np.asarray(old, np.int16) - np.asarray(new, np.int16))
+        old_times.append(t_old)
+        new_times.append(t_new)
+        old_bytes.append(new_w*new_h*3)
+        print(f"{os.path.basename(path)[:31]:<32}{t_old:>9.3f}{t_new:>9.3f}"
+              f"{old_bytes[-1]/2**20:>9.1f}{cell_w*cell_h*3/2**20:>9.1f}{int(diff.max()):>10}")
+    print(f"\nresize+crop total: old {sum(old_times):.2f}s, new {sum(new_times):.2f}s, "
+          f"speedup x{sum(old_times)/max(sum(new_times), 1e-9):.1f}")
+    print(f"peak intermediate: old {max(old_bytes)/2**20:.1f} MB, new {cell_w*cell_h*3/2**20:.1f} MB")
+
+
+def bench_thumbs(files, store_dir):
+    """Setup-dialog thumbnails: the old Image.thumbnail path vs reduced decode vs EXIF thumbnail vs disk store."""
+    size = thumbs.THUMB_SIZE
+    thumbs.THUMB_STORE_DIR = store_dir
+    rows = {"old": [], "reduced": [], "exif": [], "store": []}
+    print(f"{'image':<32}{'old s':>9}{'reduced s':>11}{'exif s':>9}{'store s':>9}")
+    for path in files:
+        def old():
+            pil_img = Image.open(path)
+            pil_img.thumbnail(size)
+            return pil_img
+
+        def exif():
+            with Image.open(path) as pil_img:
+                return thumbs.exif_thumbnail(pil_img, size)
+
+        _, t_old = timed(old)
+        _, t_reduced = timed(lambda: thumbs.reduced_thumbnail(Image.open(path), size))
+        found, t_exif = timed(exif)
+        thumbs.load_thumbnail(path, size, store=True)  # fill the store
+        _, t_store = timed(thumbs.load_thumbnail, path, size, True)
+        rows["old"].append(t_old)
+        rows["reduced"].append(t_reduced)
+        rows["store"].append(t_store)
+        if found is not None:
+            rows["exif"].append(t_exif)
+        shown = f"{t_exif:>9.4f}" if found is not None else f"{'-':>9}"
+        print(f"{os.path.basename(path)[:31]:<32}{t_old:>9.4f}{t_reduced:>11.4f}{shown}{t_store:>9.4f}")
+    print()
+    for name, times in rows.items():
+        if times:
+            print(f"{name:<8} {len(times)/sum(times):>9.1f} thumbs/s  (median {statistics.median(times)*1000:.1f} ms)")
+    print(f"EXIF thumbnails usable for {len(rows['exif'])}/{len(files)} images")
+
+
+def legacy_render_cell(path, cell_w, cell_h, max_side=engine.DETECT_MAX_SIDE):
+    """
+    The per-image path before the shared detection plane: a same-mode RGB copy,
+    a rotated copy, an RGB array and its BGR conversion, then one grayscale
+    conversion per detector.
+    """
+    pil_img = upright(engine.open_for_cell(path, cell_w, cell_h).copy())
+    np_img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+    proxy, sx, sy = detection_proxy(np_img, max_side)
+    gray = cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY)
+    fx, fy, fw, fh = engine.faces_bbox(engine.get_face_detector().detect(gray), gray.shape[1], gray.shape[0])
+    bx, by, bw, bh = engine.detect_subject_bbox(cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY))
+    bbox = min(fx, bx)*sx, min(fy, by)*sy, max(fx+fw, bx+bw)*sx, max(fy+fh, by+bh)*sy
+    return engine.place_image_in_cell(pil_img, cell_w, cell_h, None, bbox)
+
+
+CELL_PATHS = {"old": legacy_render_cell, "new": render_cell}
+
+CELL_PATH_SNIPPET = """
+import sys, json
+import montage_bench
+print(json.dumps(montage_bench.run_cell_path(sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4:])))
+"""
+
+
+def run_cell_path(variant, cell, max_side, files):
+    """
+    Renders every file through one per-image path in this process (detection
+    cache off). Returns per-image seconds and the peak memory the path added
+    on top of the warmed-up process.
+    """
+    engine.DETECT_CACHE = False
+    render = CELL_PATHS[variant]
+    engine.warm_up()
+    render(files[0], 8, 8, max_side)  # first-call setup, at a negligible size
+    base = peak_rss_mb()
+    times = [timed(render, path, *parse_size(cell), max_side)[1] for path in files]
+    peak = peak_rss_mb()
+    return {"times": times, "peak_mb": None if base is None else round(peak - base, 1)}
+
+
+def bench_cell_path(files, cell, max_side):
+    """
+    Per-image path (decode -> detect -> place) before and after the shared
+    grayscale plane: latency and peak added memory, each in a fresh
+    interpreter, plus how far the two outputs differ.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    cell_text = f"{cell[0]}x{cell[1]}"
+    report = {}
+    print(f"{len(files)} images, cell {cell_text}, detection proxy {max_side or 'off'}")
+    print(f"{'path':<8}{'p50 ms':>9}{'p95 ms':>9}{'img/s':>8}{'peak +MB':>10}")
+    for variant in CELL_PATHS:
+        out = subprocess.run([sys.executable, "-c", CELL_PATH_SNIPPET, variant, cell_text, str(max_side or 0), *files],
+                             cwd=here, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"{variant:<8}failed: {out.stderr.strip().splitlines()[-1:]}")
+            continue
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        times = sorted(result["times"])
+        entry = {"p50_ms": round(statistics.median(times)*1000, 1),
+                 "p95_ms": round(times[min(len(times)-1, int(len(times)*0.95))]*1000, 1),
+                 "images_per_s": round(len(times)/sum(times), 2), "peak_mb": result["peak_mb"]}
+        report[variant] = entry
+        peak = "-" if entry["peak_mb"] is None else entry["peak_mb"]
+        print(f"{variant:<8}{entry['p50_ms']:>9}{entry['p95_ms']:>9}{entry['images_per_s']:>8}{peak:>10}")
+
+    engine.DETECT_CACHE = False
+    diffs = []
+    for path in files:
+        a = np.asarray(legacy_render_cell(path, *cell, max_side), np.int16)
+        b = np.asarray(render_cell(path, *cell, max_side), np.int16)
+        diffs.append(int(np.abs(a - b).max()))
+    report["max_pixel_diff"] = diffs
+    print(f"\nmax pixel difference per image: {diffs}")
+    print(json.dumps(report))
+
+
+def bench_detectors(files, cell, max_side, batch, yunet_model=None):
+    """
+    Face detector backends on the same images: detection throughput one image
+    at a time and in batches, images with faces, and how far each backend
+    moves the crop compared with the Haar crop (cell pixels).
+    """
+    import montage_detectors
+    saved = engine.FACE_DETECTOR, engine.YUNET_MODEL
+    if yunet_model:
+        engine.YUNET_MODEL = yunet_model
+    images = [engine.open_for_cell(path, *cell) for path in files]
+    report, crops = {}, {}
+    print(f"{len(files)} images, detection proxy {max_side or 'off'}, batch {batch}")
+    print(f"{'backend':<10}{'img/s x1':>10}{f'img/s x{batch}':>11}{'with faces':>12}{'drift p50':>11}{'drift max':>11}")
+    try:
+        for name in montage_detectors.BACKENDS:
+            engine.FACE_DETECTOR = name
+            try:
+                detector = engine.get_face_detector()
+            except (OSError, ValueError) as e:
+                print(f"{name:<10}skipped: {e}")
+                continue
+            planes = [engine.detection_planes(img, max_side, detector.needs_color) for img in images]
+            inputs = [bgr if detector.needs_color else gray for gray, bgr, _, _ in planes]
+            detector.detect_batch(inputs[:1])  # first-call setup
+            _, t_single = timed(lambda: [detector.detect_batch([image]) for image in inputs])
+            faces, t_batch = timed(lambda: [found for i in range(0, len(inputs), batch)
+                                            for found in detector.detect_batch(inputs[i:i+batch])])
+            crops[name] = [engine.crop_window(*engine.upright_size(img), engine.combined_bbox(gray, found, sx, sy), *cell)[2:]
+                           for img, (gray, _, sx, sy), found in zip(images, planes, faces)]
+            drifts = [max(abs(ax-bx), abs(ay-by)) for (ax, ay), (bx, by) in zip(crops[name], crops.get("haar", crops[name]))]
+            entry = {"images_per_s": round(len(inputs)/t_single, 2), "images_per_s_batched": round(len(inputs)/t_batch, 2),
+                     "with_faces": sum(1 for found in faces if found), "drift_p50": statistics.median(drifts),
+                     "drift_max": max(drifts)}
+            report[name] = entry
+            print(f"{name:<10}{entry['images_per_s']:>10}{entry['images_per_s_batched']:>11}"
+                  f"{entry['with_faces']:>7}/{len(files):<4}{entry['drift_p50']:>11}{entry['drift_max']:>11}")
+    finally:
+        engine.FACE_DETECTOR, engine.YUNET_MODEL = saved
+    print(json.dumps(report))
+
+
+# ---------- Suite ----------
+# name -> (size, file extension, faces per image)
+SUITE_SETS = {
+    "jpg-12mp": ((4000, 3000), ".jpg", 0),
+    "jpg-24mp-faces": ((6000, 4000), ".jpg", 2),
+    "png-6mp-face": ((3000, 2000), ".png", 1),
+    "tif-6mp": ((3000, 2000), ".tif", 0),
+}
+SUITE_GRIDS = ("1x1", "2x2", "3x3")
+SUITE_PAGES = ("A4", "Letter")
+SUITE_QUICK = {"sets": ("jpg-12mp", "png-6mp-face"), "grids": ("2x2",), "pages": ("A4",), "count": 4}
+
+# Stages reported, in pipeline order: the montage_profile spans make_pages
+# records (see montage_profile). Per image except faces (per detection batch)
+# and encode / commit (per page).
+STAGES = ("decode", "cache", "planes", "faces", "subject", "crop", "resize", "paste", "encode", "commit")
+
+SUITE_SNIPPET = """
+import sys, json
+import montage_bench
+print(json.dumps(montage_bench.run_suite_case(json.loads(sys.argv[1]))))
+"""
+
+
+def run_suite_case(case):
+    """
+    One suite case in this process (detection cache and resume off): make_pages
+    end to end with a Profiler, so the stage times are those of the real run.
+    peak_mb is the memory make_pages added on top of the warmed-up process.
+    """
+    engine.DETECT_CACHE = False
+    engine.warm_up()
+    files, fmt, max_side = case["files"], case["format"], case["max_side"] or None
+    page_size = engine.PAGE_SIZES[case["page"]]
+    rows, cols = parse_grid(case["grid"])
+    layout = engine.page_layout(page_size, rows, cols)
+    profiler = Profiler()
+    base = peak_rss_mb()
+    t0 = time.perf_counter()
+    engine.make_pages(files, page_size, rows, cols, os.path.join(case["out_dir"], "pages"), None, 1,
+                      workers=case["workers"], fmt=fmt, detect_max_side=max_side, resume=False, profiler=profiler)
+    seconds = time.perf_counter() - t0
+    peak = peak_rss_mb()
+    engine.shutdown_render_pool()
+    times = profiler.stage_times()
+    return {"seconds": seconds, "pages": page_count(len(files), layout),
+            "peak_mb": None if base is None else round(peak - base, 1),
+            "stages": {name: times[name] for name in STAGES if name in times}}
+
+
+def summarize_stages(stages):
+    return {name: {"p50_ms": round(percentile(times, 50)*1000, 2), "p95_ms": round(percentile(times, 95)*1000, 2),
+                   "total_s": round(sum(times), 3)}
+            for name, times in stages.items() if times}
+
+
+def environment():
+    """What a result was measured on, so runs from different versions/machines can be told apart."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(), "opencv": cv2.__version__,
+            "pillow": Image.__version__, "face_detector": engine.FACE_DETECTOR}
+
+
+def compare_suite(report, old_path):
+    """Prints img/s, pages/s, per-stage p50 and peak memory of report against an earlier suite result."""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    old_cases = {case["name"]: case for case in old.get("cases", [])}
+    print(f"\ncompared with {old_path} (commit {old.get('environment', {}).get('commit')})")
+    print(f"{'case':<34}{'img/s':>14}{'pages/s':>14}{'peak MB':>14}")
+    ratio = lambda new, was: f"{new/was:>6.2f}x" if new and was else "     -"
+    for case in report["cases"]:
+        was = old_cases.get(case["name"])
+        if not was:
+            print(f"{case['name']:<34}  (new case)")
+            continue
+        peak = "-" if case["peak_mb"] is None or was["peak_mb"] is None else f"{case['peak_mb'] - was['peak_mb']:+.1f}"
+        print(f"{case['name']:<34}{ratio(case['images_per_s'], was['images_per_s']):>14}"
+              f"{ratio(case['pages_per_s'], was['pages_per_s']):>14}{peak:>14}")
+        slower = [f"{name} {ratio(stage['p50_ms'], was['stages'][name]['p50_ms']).strip()}"
+                  for name, stage in case["stages"].items()
+                  if name in was.get("stages", {}) and stage["p50_ms"] >= 1
+                  and stage["p50_ms"] > was["stages"][name]["p50_ms"] * 1.1]
+        if slower:
+            print(f"{'':<4}slower p50: {', '.join(slower)}")
+
+
+def bench_suite(out_dir, sets, grids, pages, count, fmt, workers, max_side, json_out=None, compare=None):
+    """
+    The render pipeline over generated image sets x grids x page sizes. Every
+    case runs make_pages once in a fresh interpreter: images/s, pages/s, peak
+    memory added, and p50/p95 of each profiled stage. Writes the report as JSON.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    made = {}
+    for name in sets:
+        size, ext, faces = SUITE_SETS[name]
+        set_dir = os.path.join(out_dir, "sets", name)
+        os.makedirs(set_dir, exist_ok=True)
+        made[name] = synthetic_images(set_dir, count, size, ext, seed=len(made), faces=faces)
+    report = {"environment": environment(),
+              "settings": {"images_per_set": count, "format": fmt, "workers": workers, "max_side": max_side},
+              "cases": []}
+    print(f"{count} images per set, {fmt} pages, {workers} workers, detection proxy {max_side or 'off'}")
+    print(f"{'case':<34}{'img/s':>8}{'pages/s':>9}{'peak MB':>9}   slowest stages (p50 ms)")
+    for set_name, files in made.items():
+        for grid in grids:
+            for page in pages:
+                name = f"{set_name} {grid} {page}"
+                case_dir = tempfile.mkdtemp(dir=out_dir)
+                case = {"files": files, "format": fmt, "grid": grid, "page": page, "workers": workers,
+                        "max_side": max_side, "out_dir": case_dir}
+                out = subprocess.run([sys.executable, "-c", SUITE_SNIPPET, json.dumps(case)],
+                                     cwd=here, capture_output=True, text=True)
+                if out.returncode != 0:
+                    print(f"{name:<34}failed: {out.stderr.strip().splitlines()[-1:]}")
+                    continue
+                result = json.loads(out.stdout.strip().splitlines()[-1])
+                stages = summarize_stages(result["stages"])
+                entry = {"name": name, "set": set_name, "grid": grid, "page": page, "images": len(files),
+                         "pages": result["pages"], "seconds": round(result["seconds"], 3),
+                         "images_per_s": round(len(files) / result["seconds"], 2),
+                         "pages_per_s": round(result["pages"] / result["seconds"], 2),
+                         "peak_mb": result["peak_mb"], "stages": stages}
+                report["cases"].append(entry)
+                slowest = sorted(stages.items(), key=lambda kv: -kv[1]["p50_ms"])[:3]
+                peak = "-" if entry["peak_mb"] is None else entry["peak_mb"]
+                print(f"{name:<34}{entry['images_per_s']:>8}{entry['pages_per_s']:>9}{peak:>9}   "
+                      + ", ".join(f"{stage} {s['p50_ms']:.0f}" for stage, s in slowest))
+    if json_out:
+        with open(json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        print(f"\nwrote {json_out}")
+    else:
+        print(json.dumps(report))
+    if compare:
+        compare_suite(report, compare)
+
+
+def bench_subject(files, cell, max_side):
+    """
+    Subject locators on the detection plane and on the full-resolution plane:
+    time per image (p50/max) and how far each moves the crop compared with
+    the contour locator (cell pixels; faces left out).
+    """
+    saved = engine.SUBJECT_DETECTOR
+    images = [engine.open_for_cell(path, *cell) for path in files]
+    sides = [max_side, 0] if max_side else [0]
+    report, crops = {}, {}
+    print(f"{len(files)} images, cell {cell[0]}x{cell[1]}")
+    print(f"{'locator':<10}{'plane':>7}{'p50 ms':>9}{'max ms':>9}{'drift p50':>11}{'drift max':>11}")
+    try:
+        for side in sides:
+            planes = [engine.detection_planes(img, side) for img in images]
+            for name in engine.SUBJECT_LOCATORS:
+                engine.SUBJECT_DETECTOR = name
+                engine.detect_subject_bbox(planes[0][0])  # first-call setup
+                boxes, times = [], []
+                for gray, _, sx, sy in planes:
+                    bbox, seconds = timed(engine.detect_subject_bbox, gray)
+                    x, y, w, h = bbox
+                    boxes.append((x*sx, y*sy, (x+w)*sx, (y+h)*sy))
+                    times.append(seconds)
+                crops[name, side] = [engine.crop_window(*engine.upright_size(img), bbox, *cell)[2:]
+                                     for img, bbox in zip(images, boxes)]
+                reference = crops.get(("contours", side), crops[name, side])
+                drifts = [max(abs(ax-bx), abs(ay-by)) for (ax, ay), (bx, by) in zip(crops[name, side], reference)]
+                entry = {"p50_ms": round(statistics.median(times)*1000, 2), "max_ms": round(max(times)*1000, 2),
+                         "drift_p50": statistics.median(drifts), "drift_max": max(drifts)}
+                report[f"{name} {side or 'full'}"] = entry
+                print(f"{name:<10}{side or 'full':>7}{entry['p50_ms']:>9}{entry['max_ms']:>9}"
+                      f"{entry['drift_p50']:>11}{entry['drift_max']:>11}")
+    finally:
+        engine.SUBJECT_DETECTOR = saved
+    print(json.dumps(report))
+
+
+FORMAT_CASES = [
+    ("png level 1", "png", {"PNG_COMPRESS_LEVEL": 1}),
+    ("png level 6", "png", {"PNG_COMPRESS_LEVEL": 6}),
+    ("png level 9", "png", {"PNG_COMPRESS_LEVEL": 9}),
+    ("jpg q95", "jpg", {"JPEG_QUALITY": 95}),
+    ("tif lzw", "tif", {"TIFF_COMPRESSION": "tiff_lzw"}),
+    ("tif raw", "tif", {"TIFF_COMPRESSION": "raw"}),
+    ("pdf jpeg q95", "pdf", {"JPEG_QUALITY": 95, "PDF_IMAGE_CODEC": "jpeg"}),
+    ("pdf flate l6", "pdf", {"PNG_COMPRESS_LEVEL": 6, "PDF_IMAGE_CODEC": "flate"}),
+]
+
+
+def bench_formats(files, pages, out_dir):
+    """Page encoding throughput per output format, 1 writer thread vs WRITE_WORKERS."""
+    page_size = engine.PAGE_SIZES["A4"]
+    composed = engine.make_pages(files[:4], page_size, 2, 2, out_dir, None, 0, workers=1, fmt="png")
+    page = Image.open(composed[0]).convert("RGB")
+    threads = engine.WRITE_WORKERS
+    saved = {k: getattr(engine, k) for k in ("PNG_COMPRESS_LEVEL", "JPEG_QUALITY", "TIFF_COMPRESSION", "PDF_IMAGE_CODEC")}
+    report = {}
+    print(f"{pages} A4 pages per run, {threads} writer threads ({os.cpu_count()} CPUs)")
+    print(f"{'format':<16}{'pages/s x1':>12}{f'pages/s x{threads}':>14}{'MB/page':>10}")
+    for name, fmt, options in FORMAT_CASES:
+        for k, v in options.items():
+            setattr(engine, k, v)
+        rates = []
+        for workers in (1, threads):
+            run_dir = os.path.join(out_dir, f"{fmt}_{workers}")
+            os.makedirs(run_dir, exist_ok=True)
+            t0 = time.perf_counter()
+            writer = engine.PageWriter(engine.open_page_sink(fmt, run_dir, 1), workers, None, workers)
+            for i in range(pages):
+                writer.put(i, page)
+            writer.close()
+            rates.append(pages / (time.perf_counter() - t0))
+            size = sum(os.path.getsize(os.path.join(run_dir, f)) for f in os.listdir(run_dir))
+        report[name] = {"pages_per_s_serial": round(rates[0], 2), "pages_per_s_pool": round(rates[1], 2),
+                        "mb_per_page": round(size / pages / 2**20, 2)}
+        print(f"{name:<16}{rates[0]:>12.2f}{rates[1]:>14.2f}{size/pages/2**20:>10.2f}")
+    for k, v in saved.items():
+        setattr(engine, k, v)
+    print(json.dumps(report))
+
+
+STARTUP_SNIPPET = r"""
+import sys, time, json, runpy
+t0 = time.perf_counter()
+result = {}
+try:
+    mod = runpy.run_path(sys.argv[1], run_name="montage_startup_bench")
+    result["import_s"] = time.perf_counter() - t0
+    from tkinter import Tk
+    root = Tk()
+    mod["MontageGUI"](root)
+    root.update()
+    result["window_s"] = time.perf_counter() - t0
+    root.destroy()
+except Exception as e:
+    result["error"] = f"{type(e).__name__}: {e}"
+print(json.dumps(result))
+"""
+
+STARTUP_SCRIPTS = ("Project + GUI.py", "Montage (pyinstaller ready).py")
+
+
+def bench_startup(repeat):
+    """
+    Cold start of each GUI script in a fresh interpreter: module import time and
+    time until the first window has been drawn (needs a display). Prints JSON too,
+    so results can be tracked between versions.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    interp = [timed(subprocess.run, [sys.executable, "-c", "pass"])[1] for _ in range(repeat)]
+    report = {"interpreter_s": statistics.median(interp)}
+    for script in STARTUP_SCRIPTS:
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET, os.path.join(here, script)],
+                                 cwd=here, capture_output=True, text=True).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]) if out.strip() else {"error": "no output"})
+        entry = {}
+        for field in ("import_s", "window_s"):
+            values = [r[field] for r in runs if field in r]
+            if values:
+                entry[field] = round(statistics.median(values), 4)
+        errors = {r["error"] for r in runs if "error" in r}
+        if errors:
+            entry["error"] = "; ".join(sorted(errors))
+        report[script] = entry
+        shown = ", ".join(f"{k} {v}" for k, v in entry.items())
+        print(f"{script:<36}{shown}")
+    print(f"(interpreter startup {report['interpreter_s']:.3f}s, median of {repeat})")
+    print(json.dumps(report))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Montage engine benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("proxy", help="full-res vs proxy detection speed and crop drift")
+    p.add_argument("inputs", nargs="*", help="image files, folders or globs")
+    p.add_argument("--max-side", type=int, default=engine.DETECT_MAX_SIDE)
+    p.add_argument("--count", type=int, default=6, help="synthetic images when no inputs")
+    p = sub.add_parser("decode", help="full vs draft (reduced-size) JPEG decoding")
+    p.add_argument("inputs", nargs="*", help="image files, folders or globs")
+    p.add_argument("--count", type=int, default=6, help="synthetic images when no inputs")
+    p = sub.add_parser("crop", help="resize-then-crop vs crop-before-resize")
+    p.add_argument("inputs", nargs="*", help="image files, folders or globs")
+    p.add_argument("--cell", type=parse_size, default=A4_2x2_CELL, help="cell size WxH")
+    p.add_argument("--count", type=int, default=6, help="synthetic images when no inputs")
+    p = sub.add_parser("startup", help="GUI import and first-window time")
+    p.add_argument("--repeat", type=int, default=5)
+    p = sub.add_parser("formats", help="page encoding throughput per output format")
+    p.add_argument("inputs", nargs="*", help="image files, folders or globs")
+    p.add_argument("--pages", type=int, default=8, help="pages encoded per format")
+    p.add_argument("--count", type=int, default=4, help="synthetic images when no inputs")
+    p = sub.add_parser("cellpath", help="per-image decode/detect/place latency and memory, old vs new")
+    p.add_argument("inputs", nargs="*", help="image files, folders or globs")
+    p.add_argument("--cell", type=parse_size, default=A4_2x2_CELL, help="cell size WxH")
+    p.add_argument("--max-side", type=int, default=engine.DETECT_MAX_SIDE)
+    p.add_argument("--count", type=int, default=6, help="synthetic images when no inputs")
+    p = sub.add_parser("detectors", help="face detector backends: throughput, faces found, crop drift")
+    p.add_argument("inputs", nargs="*", help="image files, folders or globs")
+    p.add_argument("--cell", type=parse_size, default=A4_2x2_CELL, help="cell size WxH")
+    p.add_argument("--max-side", type=int, default=engine.DETECT_MAX_SIDE)
+    p.add_argument("--batch", type=int, default=engine.DETECT_BATCH)
+    p.add_argument("--yunet-model", help="face_detection_yunet_*.onnx (skipped if missing)")
+    p.add_argument("--count", type=int, default=6, help="synthetic images when no inputs")
+    p = sub.add_parser("subject", help="subject locators: time per image at proxy and full size, crop drift")
+    p.add_argument("inputs", nargs="*", help="image files, folders or globs")
+    p.add_argument("--cell", type=parse_size, default=A4_2x2_CELL, help="cell size WxH")
+    p.add_argument("--max-side", type=int, default=engine.DETECT_MAX_SIDE)
+    p.add_argument("--count", type=int, default=6, help="synthetic images when no inputs")
+    p = sub.add_parser("suite", help="render pipeline over synthetic sets: per-stage p50/p95, img/s, pages/s, memory")
+    p.add_argument("--sets", nargs="+", choices=sorted(SUITE_SETS), help="default: all")
+    p.add_argument("--grids", nargs="+", help=f"default: {' '.join(SUITE_GRIDS)}")
+    p.add_argument("--pages", nargs="+", choices=sorted(engine.PAGE_SIZES), help=f"default: {' '.join(SUITE_PAGES)}")
+    p.add_argument("--count", type=int, help="images per set (default 8)")
+    p.add_argument("--quick", action="store_true", help="two sets, one grid, one page size, 4 images")
+    p.add_argument("--format", choices=engine.OUTPUT_FORMATS, default="png")
+    p.add_argument("--workers", type=int, default=engine.RENDER_WORKERS)
+    p.add_argument("--max-side", type=int, default=engine.DETECT_MAX_SIDE)
+    p.add_argument("--json-out", help="write the report here instead of printing it")
+    p.add_argument("--compare", help="an earlier --json-out report to compare against")
+    p = sub.add_parser("thumbs", help="dialog thumbnail decoding: full, reduced, EXIF, disk store")
+    p.add_argument("inputs", nargs="*", help="image files, folders or globs")
+    p.add_argument("--count", type=int, default=6, help="synthetic images when no inputs")
+    args = parser.parse_args(argv)
+
+    if args.bench == "startup":
+        bench_startup(args.repeat)
+        return 0
+    if args.bench == "suite":
+        quick = SUITE_QUICK if args.quick else {}
+        with tempfile.TemporaryDirectory() as tmp:
+            bench_suite(tmp, args.sets or quick.get("sets", tuple(SUITE_SETS)), args.grids or quick.get("grids", SUITE_GRIDS),
+                        args.pages or quick.get("pages", SUITE_PAGES), args.count or quick.get("count", 8),
+                        args.format, max(1, args.workers), args.max_side, args.json_out, args.compare)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = expand_inputs(args.inputs) if args.inputs else synthetic_images(tmp, args.count)
+        if args.bench == "thumbs" and not args.inputs:
+            for path in files:
+                with_exif_thumbnail(path)
+        if not files:
+            print("No images found.")
+            return 1
+        if args.bench == "proxy":
+            bench_proxy(files, args.max_side, A4_2x2_CELL)
+        elif args.bench == "decode":
+            bench_decode(files, A4_2x2_CELL)
+        elif args.bench == "crop":
+            bench_crop(files, args.cell)
+        elif args.bench == "formats":
+            bench_formats(files, args.pages, os.path.join(tmp, "formats"))
+        elif args.bench == "thumbs":
+            bench_thumbs(files, os.path.join(tmp, "thumbs"))
+        elif args.bench == "cellpath":
+            bench_cell_path(files, args.cell, args.max_side)
+        elif args.bench == "subject":
+            bench_subject(files, args.cell, args.max_side)
+        elif args.bench == "detectors":
+            bench_detectors(files, args.cell, args.max_side, max(1, args.batch), args.yunet_model)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+montage_cache.py
+
+Persistent cache of detection results so re-laying-out a photo set
+(different grid / page type) skips face and subject detection.
+
+- Entries are keyed by a content digest of the file plus the detector signature
+- Digests are memoised per (path, mtime, size) so unchanged files aren't re-read
+- Boxes are stored normalised to the upright image, so decode size doesn't matter
+- Least-recently-used entries are evicted once the database passes MAX_MB
+
+  python montage_cache.py info
+  python montage_cache.py clear
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import pathlib
+import threading
+import functools
+
+# ---------- Config ----------
+CACHE_DIR = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.join(pathlib.Path.home(), ".cache"), "Montage")
+CACHE_FILE = "detections.sqlite3"
+MAX_MB = 64
+EVICT_CHECK_EVERY = 200  # puts between size checks
+# ----------------------------
+
+_cache = None
+
+
+def file_digest(path, chunk=1 << 20):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class DetectionCache:
+    def __init__(self, path=None, max_mb=MAX_MB):
+        self.path = path or os.path.join(CACHE_DIR, CACHE_FILE)
+        self.max_bytes = int(max_mb * 2**20)
+        self._puts = 0
+        self.lock = threading.RLock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, digest TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS boxes (key TEXT PRIMARY KEY, x1 REAL, y1 REAL, x2 REAL, y2 REAL, last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS boxes_last_used ON boxes (last_used)")
+
+    def digest(self, img_path):
+        """Content digest of img_path, re-hashed only when its mtime or size changes."""
+        path = os.path.abspath(img_path)
+        st = os.stat(path)
+        with self.lock:
+            row = self.db.execute("SELECT mtime_ns, size, digest FROM files WHERE path=?", (path,)).fetchone()
+        if row and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+            return row[2]
+        digest = file_digest(path)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?)", (path, st.st_mtime_ns, st.st_size, digest))
+        return digest
+
+    def key(self, img_path, signature):
+        return f"{self.digest(img_path)}:{signature}"
+
+    @_locked
+    def get(self, key):
+        """Returns the normalised (x1, y1, x2, y2) box or None."""
+        row = self.db.execute("SELECT x1, y1, x2, y2 FROM boxes WHERE key=?", (key,)).fetchone()
+        if row:
+            self.db.execute("UPDATE boxes SET last_used=? WHERE key=?", (time.time(), key))
+        return row
+
+    @_locked
+    def put(self, key, box):
+        self.db.execute("INSERT OR REPLACE INTO boxes VALUES (?,?,?,?,?,?)", (key, *map(float, box), time.time()))
+        self._puts += 1
+        if self._puts % EVICT_CHECK_EVERY == 0:
+            self.evict()
+
+    @_locked
+    def used_bytes(self):
+        page_size = self.db.execute("PRAGMA page_size").fetchone()[0]
+        pages = self.db.execute("PRAGMA page_count").fetchone()[0]
+        free = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size
+
+    @_locked
+    def evict(self):
+        """Drops least-recently-used boxes (and stale digests) until under max_bytes."""
+        while self.used_bytes() > self.max_bytes:
+            count = self.db.execute("SELECT COUNT(*) FROM boxes").fetchone()[0]
+            if count == 0:
+                self.db.execute("DELETE FROM files")
+                break
+            self.db.execute("DELETE FROM boxes WHERE key IN (SELECT key FROM boxes ORDER BY last_used LIMIT ?)", (max(1, count // 10),))
+            self.db.execute("DELETE FROM files WHERE digest NOT IN (SELECT substr(key, 1, 40) FROM boxes)")
+
+    @_locked
+    def clear(self):
+        self.db.execute("DELETE FROM boxes")
+        self.db.execute("DELETE FROM files")
+        self.db.execute("VACUUM")
+
+    @_locked
+    def info(self):
+        boxes = self.db.execute("SELECT COUNT(*) FROM boxes").fetchone()[0]
+        files = self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return {"path": self.path, "entries": boxes, "files": files, "bytes": self.used_bytes(), "max_bytes": self.max_bytes}
+
+    @_locked
+    def close(self):
+        self.db.close()
+
+
+def get_cache():
+    """Process-wide cache instance, or None if the cache can't be opened."""
+    global _cache
+    if _cache is None:
+        try:
+            _cache = DetectionCache()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: detection cache disabled: {e}")
+            _cache = False
+    return _cache or None
+
+
+def clear_cache():
+    cache = get_cache()
+    if cache:
+        cache.clear()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    cmd = argv[0] if argv else "info"
+    cache = get_cache()
+    if cache is None:
+        return 1
+    if cmd == "clear":
+        cache.clear()
+        print(f"Cleared {cache.path}")
+    elif cmd == "info":
+        for k, v in cache.info().items():
+            print(f"{k}: {v}")
+    else:
+        print(f"Unknown command: {cmd} (use info or clear)")
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+montage_detectors.py
+
+Face detector backends for subject-aware cropping (see montage_engine).
+
+- haar:  OpenCV's Haar cascade on the grayscale detection plane. The default;
+         needs no extra files, but is slow at fine scale steps and misses
+         turned or profile faces
+- yunet: OpenCV's YuNet CNN (cv2.FaceDetectorYN, CPU) on a BGR proxy. Copes
+         with tilted and profile faces; needs the ONNX model, e.g.
+         face_detection_yunet_2023mar.onnx from the OpenCV model zoo
+
+A backend takes a batch of images (grayscale planes, or BGR images when
+needs_color is set) and returns, per image, a list of (x, y, w, h) faces.
+"""
+
+import os
+import cv2
+
+
+class FaceDetector:
+    name = ""
+    needs_color = False  # detect_batch() gets BGR images instead of grayscale planes
+
+    def detect(self, image):
+        raise NotImplementedError
+
+    def detect_batch(self, images):
+        return [self.detect(image) for image in images]
+
+
+class HaarDetector(FaceDetector):
+    name = "haar"
+
+    def __init__(self, cascade_path, scale_factor=1.1, min_neighbors=5, min_size=30):
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
+            raise ValueError(f"could not load the Haar cascade {cascade_path}")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = (min_size, min_size)
+
+    def detect(self, gray):
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                              minNeighbors=self.min_neighbors, minSize=self.min_size)
+        return [tuple(int(v) for v in face) for face in faces]
+
+
+class YuNetDetector(FaceDetector):
+    name = "yunet"
+    needs_color = True
+
+    def __init__(self, model_path, score_threshold=0.6, nms_threshold=0.3, top_k=50):
+        if not model_path or not os.path.isfile(model_path):
+            raise FileNotFoundError(f"YuNet model not found: {model_path} "
+                                    "(get face_detection_yunet_2023mar.onnx from the OpenCV model zoo)")
+        self.input_size = (320, 320)
+        self.net = cv2.FaceDetectorYN.create(model_path, "", self.input_size, score_threshold, nms_threshold, top_k)
+
+    def detect_batch(self, images):
+        # setInputSize rebuilds the network's anchors, so same-sized images run back to back
+        results = [None] * len(images)
+        for i in sorted(range(len(images)), key=lambda i: images[i].shape[:2]):
+            h, w = images[i].shape[:2]
+            if (w, h) != self.input_size:
+                self.input_size = (w, h)
+                self.net.setInputSize(self.input_size)
+            _, faces = self.net.detect(images[i])
+            results[i] = [] if faces is None else [self._clip(*face[:4]) for face in faces]
+        return results
+
+    def detect(self, image):
+        return self.detect_batch([image])[0]
+
+    @staticmethod
+    def _clip(x, y, w, h):
+        # boxes may start above or left of the image
+        x1, y1 = max(0, int(x)), max(0, int(y))
+        return x1, y1, int(x + w) - x1, int(y + h) - y1
+
+
+BACKENDS = {"haar": HaarDetector, "yunet": YuNetDetector}
+
+
+def create_detector(name, **options):
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"unknown face detector: {name} (choose from {', '.join(BACKENDS)})")
+    return backend(**options)
@@ -0,0 +1,1109 @@
+#!/usr/bin/env python3
+"""
+montage_engine.py
+
+Image handling shared by the GUI builds and the core script:
+- Reduced-size JPEG decoding sized to the target cell, done once per image
+- Very large uncompressed TIFF / BMP / PPM inputs read in memory-mapped bands and
+  box-reduced on the way in (montage_tiles), so multi-gigapixel scans fit in RAM
+- Face + main subject detection on one shared grayscale plane, cached on disk per file
+- Main subject by largest edge contour, or by fixed-cost spectral-residual saliency
+- Pluggable face detector backends (Haar cascade, YuNet), run on batches of images
+- Scaling / cropping an image into a grid cell
+- Page rendering, optionally spread over a process pool
+- Streaming cells -> pages -> writer with bounded memory
+- Page geometry from cached montage_layout.Layout objects (mixed grids too)
+- Pages encoded on a thread pool as PNG, JPEG, TIFF or one multi-page PDF
+- Per-task cancel / pause tokens, checked between cells and pages
+- A checkpoint manifest per task, so re-runs only render missing or changed pages
+- Optional per-stage timings (montage_profile), free when switched off
+- cv2 / numpy are imported lazily so GUIs can start before they load
+"""
+
+import io
+import os
+import math
+import importlib
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+import montage_cache
+import montage_tiles
+from montage_layout import Layout, get_layout, iter_slots
+from montage_manifest import TaskManifest, manifest_path, fingerprint, bytes_digest, page_digests
+from montage_profile import Profiler, span, TASK
+
+# ---------- Config ----------
+PAGE_SIZES = {"A4": (2480,3508), "Letter": (2550,3300)}
+DPI = 300
+GRID_MARGIN = 40
+MARGIN_OUTER = 60
+INNER_CELL_MARGIN = 20
+# Face detector backend (see montage_detectors.py): "haar", or "yunet" for
+# OpenCV's YuNet CNN (needs YUNET_MODEL; better with turned and profile faces).
+FACE_DETECTOR = "haar"
+CASCADE_FILE = "haarcascade_frontalface_default.xml"
+CASCADE_PATH = None  # None = the copy shipped with OpenCV
+HAAR_SCALE_FACTOR = 1.1
+HAAR_MIN_NEIGHBORS = 5
+HAAR_MIN_SIZE = 30
+YUNET_FILE = "face_detection_yunet_2023mar.onnx"
+YUNET_MODEL = None  # None = YUNET_FILE next to this module
+YUNET_SCORE_THRESHOLD = 0.6
+YUNET_NMS_THRESHOLD = 0.3
+YUNET_TOP_K = 50
+# Main subject locator: "contours" (largest Canny contour on the detection
+# plane) or "saliency" (spectral-residual saliency of a SALIENCY_SIDE px
+# thumbnail; a fixed, small cost per image whatever its size or texture).
+SUBJECT_DETECTOR = "contours"
+SALIENCY_SIDE = 64
+SALIENCY_THRESHOLD = 3.0  # salient = above this many times the mean saliency
+# Images rendered per pool task; faces for a batch are found in one detector call.
+DETECT_BATCH = 4
+# Detection runs on a proxy whose longest side is at most this many px.
+# None (or 0) runs detection on the full-resolution image.
+DETECT_MAX_SIDE = 1024
+# Reuse detection results across runs (see montage_cache.py).
+DETECT_CACHE = True
+# Processes used to render cells; 1 renders serially in the calling thread.
+RENDER_WORKERS = os.cpu_count() or 1
+# Ceiling for cells in flight plus pages waiting to be written, in MB.
+RENDER_MEMORY_MB = 512
+# Page output: "png", "jpg", "tif", or "pdf" for one multi-page PDF per task.
+OUTPUT_FORMAT = "png"
+PNG_COMPRESS_LEVEL = 6          # zlib level 0-9; 1 saves several times faster, files ~10-20% bigger
+JPEG_QUALITY = 95               # JPEG pages and PDF page images
+TIFF_COMPRESSION = "tiff_lzw"   # or "raw" for uncompressed
+PDF_IMAGE_CODEC = "jpeg"        # PDF page images: "jpeg" or lossless "flate"
+# Threads encoding pages; PIL's encoders release the GIL, so this overlaps with rendering.
+WRITE_WORKERS = min(4, os.cpu_count() or 1)
+# Reuse pages a previous run of the same task recorded in its manifest
+RESUME = True
+# Time every stage of a run; the GUIs show a summary on the task card and
+# write taskNN.trace.json (Chrome trace) next to the pages
+PROFILE = False
+# ----------------------------
+
+
+class _LazyModule:
+    """Imports the named module on first attribute access (cv2/numpy cost ~0.2s+ at startup)."""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Only imported by name, so a PyInstaller build lists each as --hidden-import
+# (see Pyinstaller bash command.txt).
+cv2 = _LazyModule("cv2")
+np = _LazyModule("numpy")
+detectors = _LazyModule("montage_detectors")
+
+OUTPUT_FORMATS = ("png", "jpg", "tif", "pdf")
+FORMAT_ALIASES = {"jpeg": "jpg", "tiff": "tif"}
+
+_face_detector = None
+_face_detector_key = None
+_render_pool = None
+_render_pool_key = None
+_render_pool_lock = threading.Lock()
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskToken:
+    """
+    Cancel / pause switch for one make_pages run. Rendering checks it between
+    cells and pages; cancel() also wakes a paused run so it can wind down.
+    """
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()
+
+    def pause(self):
+        if not self._cancelled.is_set():
+            self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def wait(self):
+        """Blocks while paused; returns False once cancelled."""
+        self._running.wait()
+        return not self._cancelled.is_set()
+
+
+def set_cascade_path(path):
+    """Point the Haar detector at another cascade file (e.g. a PyInstaller bundle)."""
+    global CASCADE_PATH
+    CASCADE_PATH = path
+
+
+def detector_config():
+    """The face and subject detector settings, as passed to render pool workers."""
+    return {"FACE_DETECTOR": FACE_DETECTOR, "CASCADE_PATH": CASCADE_PATH, "HAAR_SCALE_FACTOR": HAAR_SCALE_FACTOR,
+            "HAAR_MIN_NEIGHBORS": HAAR_MIN_NEIGHBORS, "HAAR_MIN_SIZE": HAAR_MIN_SIZE, "YUNET_MODEL": YUNET_MODEL,
+            "YUNET_SCORE_THRESHOLD": YUNET_SCORE_THRESHOLD, "YUNET_NMS_THRESHOLD": YUNET_NMS_THRESHOLD,
+            "YUNET_TOP_K": YUNET_TOP_K, "SUBJECT_DETECTOR": SUBJECT_DETECTOR, "SALIENCY_SIDE": SALIENCY_SIDE,
+            "SALIENCY_THRESHOLD": SALIENCY_THRESHOLD}
+
+
+def yunet_model_path():
+    return YUNET_MODEL or os.path.join(os.path.dirname(os.path.abspath(__file__)), YUNET_FILE)
+
+
+def get_face_detector():
+    """The configured backend, created once per process and again if the settings change."""
+    global _face_detector, _face_detector_key
+    key = tuple(detector_config().items())
+    if _face_detector is None or _face_detector_key != key:
+        if FACE_DETECTOR == "haar":
+            options = {"cascade_path": CASCADE_PATH or cv2.data.haarcascades + CASCADE_FILE,
+                       "scale_factor": HAAR_SCALE_FACTOR, "min_neighbors": HAAR_MIN_NEIGHBORS, "min_size": HAAR_MIN_SIZE}
+        elif FACE_DETECTOR == "yunet":
+            options = {"model_path": yunet_model_path(), "score_threshold": YUNET_SCORE_THRESHOLD,
+                       "nms_threshold": YUNET_NMS_THRESHOLD, "top_k": YUNET_TOP_K}
+        else:
+            options = {}
+        _face_detector = detectors.create_detector(FACE_DETECTOR, **options)
+        _face_detector_key = key
+    return _face_detector
+
+
+def warm_up():
+    """Imports the CV stack and loads the face detector ahead of the first render (safe to run in a thread)."""
+    np.ndarray
+    get_face_detector()
+
+
+# ---------- Loading ----------
+def open_for_cell(img_path, cell_w, cell_h):
+    """
+    Opens img_path as RGB. JPEGs are decoded at the smallest DCT scale
+    (1/2, 1/4, 1/8) that still covers the cell once the image is rotated;
+    uncompressed images of montage_tiles.STREAM_MIN_PIXELS or more are read
+    band by band and box-reduced by the largest integer factor that still
+    covers it.
+    """
+    pil_img = montage_tiles.open_image(img_path)
+    w, h = pil_img.size
+    if w > h:
+        cell_w, cell_h = cell_h, cell_w
+    scale = max(cell_w/w, cell_h/h)
+    if pil_img.format == "JPEG":
+        if scale < 1:
+            pil_img.draft("RGB", (math.ceil(w*scale), math.ceil(h*scale)))
+    elif w*h >= montage_tiles.STREAM_MIN_PIXELS and scale <= 0.5 and montage_tiles.streamable(pil_img):
+        with pil_img:
+            return montage_tiles.open_reduced(pil_img, int(1/scale))
+    montage_tiles.check_pixels(pil_img.size)
+    pil_img.load()
+    # convert() to the same mode would still copy the whole frame
+    return pil_img if pil_img.mode == "RGB" else pil_img.convert("RGB")
+
+
+# ---------- Detection ----------
+# The subject detector and the Haar backend share one 2-D uint8 grayscale
+# plane; colour backends get a BGR proxy of the same size (see detection_planes).
+def faces_bbox(faces, w, h):
+    """Union of (x, y, w, h) faces; the centre of a w x h image if there are none."""
+    if len(faces)==0:
+        return int(w*0.3), int(h*0.3), int(w*0.4), int(h*0.4)
+    x1=min([x for (x,y,w,h) in faces])
+    y1=min([y for (x,y,w,h) in faces])
+    x2=max([x+w for (x,y,w,h) in faces])
+    y2=max([y+h for (x,y,w,h) in faces])
+    return x1,y1,x2-x1,y2-y1
+
+def detect_subject_bbox(gray):
+    """The main subject of a grayscale plane as (x, y, w, h), found by SUBJECT_DETECTOR."""
+    try:
+        locate = SUBJECT_LOCATORS[SUBJECT_DETECTOR]
+    except KeyError:
+        raise ValueError(f"unknown subject detector: {SUBJECT_DETECTOR} (choose from {', '.join(SUBJECT_LOCATORS)})")
+    return locate(gray)
+
+def contour_subject_bbox(gray):
+    blur = cv2.GaussianBlur(gray,(7,7),0)
+    edges = cv2.Canny(blur,50,150)
+    edges = cv2.dilate(edges,np.ones((5,5),np.uint8),1)
+    contours,_ = cv2.findContours(edges,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        h,w=gray.shape
+        return int(w*0.3), int(h*0.3), int(w*0.4), int(h*0.4)
+    largest = max(contours,key=cv2.contourArea)
+    x,y,w,h = cv2.boundingRect(largest)
+    return x,y,w,h
+
+def saliency_subject_bbox(gray, side=None, threshold=None):
+    """
+    Spectral-residual saliency (Hou & Zhang, 2007) on a thumbnail whose longest
+    side is `side` px: the log amplitude spectrum minus its local average, put
+    back with the original phase, highlights what stands out from the image's
+    usual texture. Returns the box of the salient region with the most
+    saliency. The plane is subsampled to about 4x the thumbnail before the
+    area resize, so the cost doesn't grow with the input size.
+    """
+    side = side or SALIENCY_SIDE
+    threshold = threshold or SALIENCY_THRESHOLD
+    h, w = gray.shape
+    f = side / max(w, h)
+    sw, sh = max(1, round(w*f)), max(1, round(h*f))
+    step = max(1, max(w, h) // (side*4))
+    small = cv2.resize(np.ascontiguousarray(gray[::step, ::step]), (sw, sh), interpolation=cv2.INTER_AREA)
+    spectrum = np.fft.fft2(small.astype(np.float32))
+    log_amp = np.log(np.abs(spectrum) + 1e-6)
+    residual = log_amp - cv2.blur(log_amp, (3, 3))
+    saliency = np.abs(np.fft.ifft2(np.exp(residual + 1j*np.angle(spectrum)))).astype(np.float32) ** 2
+    saliency = cv2.GaussianBlur(saliency, (0, 0), side / 32)
+    mask = (saliency > threshold * saliency.mean()).astype(np.uint8)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if n <= 1:
+        return int(w*0.3), int(h*0.3), int(w*0.4), int(h*0.4)
+    weight = np.bincount(labels.ravel(), saliency.ravel(), n)[1:]
+    x, y, bw, bh = stats[int(np.argmax(weight)) + 1, :4]
+    sx, sy = w/sw, h/sh
+    return int(x*sx), int(y*sy), min(w, math.ceil(bw*sx)), min(h, math.ceil(bh*sy))
+
+SUBJECT_LOCATORS = {"contours": contour_subject_bbox, "saliency": saliency_subject_bbox}
+
+def detector_signature(max_side=DETECT_MAX_SIDE):
+    """Identifies the detector settings a cached box was produced with."""
+    if FACE_DETECTOR == "haar":
+        faces = f"haar={os.path.basename(CASCADE_PATH or CASCADE_FILE)},{HAAR_SCALE_FACTOR},{HAAR_MIN_NEIGHBORS},{HAAR_MIN_SIZE}"
+    else:
+        faces = f"{FACE_DETECTOR}={os.path.basename(yunet_model_path())},{YUNET_SCORE_THRESHOLD},{YUNET_NMS_THRESHOLD},{YUNET_TOP_K}"
+    if SUBJECT_DETECTOR == "contours":
+        subject = "canny=7,50,150,5"
+    else:
+        subject = f"{SUBJECT_DETECTOR}={SALIENCY_SIDE},{SALIENCY_THRESHOLD}"
+    return f"{faces}|{subject}|proxy={max_side or 0},luma-box"
+
+def detection_planes(pil_img, max_side=DETECT_MAX_SIDE, color=False):
+    """
+    The inputs the detectors run on, for the *upright* version of pil_img.
+    Returns (gray, bgr, sx, sy); sx/sy map plane coordinates back to the
+    upright image. gray is converted to luma once (same weights as cv2's
+    BGR2GRAY, one byte per pixel), box-filtered down to max_side and only then
+    rotated, so no full-size RGB/BGR copy is made. With color=True the image
+    is box-filtered first and bgr is a BGR copy of that proxy (else None).
+    """
+    w, h = pil_img.size
+    size = None
+    if max_side and max(w, h) > max_side:
+        f = max_side / max(w, h)
+        size = max(1, int(round(w*f))), max(1, int(round(h*f)))
+    if color:
+        small = pil_img.resize(size, Image.BOX) if size else pil_img
+        gray = small.convert("L")
+    else:
+        small = None
+        gray = pil_img.convert("L")
+        if size:
+            gray = gray.resize(size, Image.BOX)
+    sx, sy = w/gray.width, h/gray.height
+    if w > h:
+        gray = gray.transpose(Image.ROTATE_90)  # the upright turn (see upright_size)
+        small = small and small.transpose(Image.ROTATE_90)
+        sx, sy = sy, sx
+    bgr = np.ascontiguousarray(np.asarray(small.convert("RGB"))[:, :, ::-1]) if small else None
+    return np.asarray(gray), bgr, sx, sy
+
+def combined_bbox(gray, faces, sx=1.0, sy=1.0):
+    """Union of the faces and the subject box on gray, as (x1, y1, x2, y2) scaled by sx/sy."""
+    fx,fy,fw,fh = faces_bbox(faces, gray.shape[1], gray.shape[0])
+    bx,by,bw,bh = detect_subject_bbox(gray)
+    x1 = min(fx,bx)
+    y1 = min(fy,by)
+    x2 = max(fx+fw, bx+bw)
+    y2 = max(fy+fh, by+bh)
+    return x1*sx, y1*sy, x2*sx, y2*sy
+
+def detect_image_bboxes(pil_imgs, max_side=DETECT_MAX_SIDE, profiler=None):
+    """Subject boxes of pil_imgs in upright coordinates (see upright_size()); faces are found in one batch."""
+    detector = get_face_detector()
+    planes = []
+    for pil_img in pil_imgs:
+        with span(profiler, "planes"):
+            planes.append(detection_planes(pil_img, max_side, detector.needs_color))
+    with span(profiler, "faces", images=len(planes)):
+        faces = detector.detect_batch([bgr if detector.needs_color else gray for gray, bgr, _, _ in planes])
+    boxes = []
+    for (gray, _, sx, sy), found in zip(planes, faces):
+        with span(profiler, "subject"):
+            boxes.append(combined_bbox(gray, found, sx, sy))
+    return boxes
+
+def detect_image_bbox(pil_img, max_side=DETECT_MAX_SIDE, profiler=None):
+    return detect_image_bboxes([pil_img], max_side, profiler)[0]
+
+
+# ---------- Placement ----------
+def upright_size(pil_img):
+    """Size of pil_img turned upright: landscape images are placed as portrait."""
+    w, h = pil_img.size
+    return (h, w) if w > h else (w, h)
+
+def crop_window(img_w, img_h, bbox, cell_w, cell_h):
+    """
+    Scale so the image fills the cell (only one dimension may overflow), then
+    position the crop so the bbox centre sits as close to the cell centre as possible.
+    Returns (new_w, new_h, crop_x, crop_y) in resized coordinates.
+    """
+    x1,y1,x2,y2 = bbox
+    scale = max(cell_w/img_w, cell_h/img_h)
+    new_w = int(round(img_w*scale))
+    new_h = int(round(img_h*scale))
+    bbox_cx = (x1+x2)/2*scale
+    bbox_cy = (y1+y2)/2*scale
+    max_crop_x = max(new_w - cell_w,0)
+    max_crop_y = max(new_h - cell_h,0)
+    crop_x = int(np.clip(bbox_cx - cell_w/2,0,max_crop_x))
+    crop_y = int(np.clip(bbox_cy - cell_h/2,0,max_crop_y))
+    return new_w, new_h, crop_x, crop_y
+
+def place_image_in_cell(pil_img, cell_w, cell_h, detect_max_side=DETECT_MAX_SIDE, bbox=None, profiler=None):
+    """
+    Fits pil_img, turned upright, to the cell. bbox, if given, is the (x1, y1, x2, y2)
+    subject box of the upright image; detection is skipped. A landscape image is
+    not rotated as a whole: the crop is taken from it and only the cell is turned.
+    """
+    img_w,img_h = upright_size(pil_img)
+    if bbox is None:
+        bbox = detect_image_bbox(pil_img, detect_max_side, profiler)
+    with span(profiler, "crop"):
+        new_w, new_h, crop_x, crop_y = crop_window(img_w, img_h, bbox, cell_w, cell_h)
+    # Resample only the source region that survives the crop
+    sx, sy = img_w/new_w, img_h/new_h
+    left, top = crop_x*sx, crop_y*sy
+    # a crop reaching the far edge can land a rounding error past it
+    right, bottom = min((crop_x+cell_w)*sx, img_w), min((crop_y+cell_h)*sy, img_h)
+    with span(profiler, "resize"):
+        if pil_img.width > pil_img.height:
+            # upright (u, v) is (img_h - v, u) before the turn. PIL resamples x then y,
+            # so resample y then x here to round exactly like the rotated image would.
+            tall = pil_img.resize((pil_img.width,cell_w),resample=Image.LANCZOS,box=(0, left, pil_img.width, right))
+            box = (img_h - bottom, 0, img_h - top, cell_w)
+            return tall.resize((cell_h,cell_w),resample=Image.LANCZOS,box=box).transpose(Image.ROTATE_90)
+        return pil_img.resize((cell_w,cell_h),resample=Image.LANCZOS,box=(left, top, right, bottom))
+
+
+# ---------- Render pool ----------
+def _init_render_worker(config, detect_cache):
+    global DETECT_CACHE
+    globals().update(config)  # the parent's detector_config()
+    DETECT_CACHE = detect_cache
+    get_face_detector()
+
+def get_render_pool(workers):
+    """Process pool shared by every make_pages call; rebuilt if the size or settings change."""
+    global _render_pool, _render_pool_key
+    config = detector_config()
+    key = (workers, tuple(config.items()), DETECT_CACHE)
+    with _render_pool_lock:
+        if _render_pool is None or _render_pool_key != key:
+            shutdown_render_pool()
+            _render_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                               initializer=_init_render_worker, initargs=(config, DETECT_CACHE))
+            _render_pool_key = key
+        return _render_pool
+
+def shutdown_render_pool():
+    global _render_pool, _render_pool_key
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+    _render_pool = None
+    _render_pool_key = None
+
+def cached_bboxes(img_paths, pil_imgs, detect_max_side=DETECT_MAX_SIDE, profiler=None):
+    """
+    Subject boxes of pil_imgs (loaded from img_paths) in upright coordinates.
+    Looked up in the detection cache first; the rest are detected as one batch
+    and stored normalised to the upright image size.
+    """
+    cache = montage_cache.get_cache() if DETECT_CACHE else None
+    signature = detector_signature(detect_max_side)
+    boxes = [None] * len(pil_imgs)
+    keys = [None] * len(pil_imgs)
+    for i, (img_path, pil_img) in enumerate(zip(img_paths, pil_imgs)):
+        if not cache:
+            break
+        try:
+            with span(profiler, "cache"):
+                keys[i] = cache.key(img_path, signature)
+                hit = cache.get(keys[i])
+        except Exception:
+            keys[i] = hit = None
+        if hit:
+            img_w, img_h = upright_size(pil_img)
+            x1, y1, x2, y2 = hit
+            boxes[i] = x1*img_w, y1*img_h, x2*img_w, y2*img_h
+    misses = [i for i, bbox in enumerate(boxes) if bbox is None]
+    if misses:
+        for i, bbox in zip(misses, detect_image_bboxes([pil_imgs[i] for i in misses], detect_max_side, profiler)):
+            boxes[i] = bbox
+            if keys[i]:
+                img_w, img_h = upright_size(pil_imgs[i])
+                x1, y1, x2, y2 = bbox
+                try:
+                    cache.put(keys[i], (x1/img_w, y1/img_h, x2/img_w, y2/img_h))
+                except Exception:
+                    pass
+    return boxes
+
+def render_cells(jobs, detect_max_side=DETECT_MAX_SIDE, profiler=None):
+    """
+    Loads and fits a batch of (img_path, cell_w, cell_h) jobs, one pool task per
+    batch. Returns the cells in order, None for files that can't be opened.
+    """
+    loaded = []
+    for img_path, cell_w, cell_h in jobs:
+        try:
+            with span(profiler, "decode", image=img_path):
+                loaded.append(open_for_cell(img_path, cell_w, cell_h))
+        except Exception:
+            loaded.append(None)
+    found = [i for i, pil_img in enumerate(loaded) if pil_img is not None]
+    boxes = cached_bboxes([jobs[i][0] for i in found], [loaded[i] for i in found], detect_max_side, profiler)
+    cells = [None] * len(jobs)
+    for i, bbox in zip(found, boxes):
+        _, cell_w, cell_h = jobs[i]
+        cells[i] = place_image_in_cell(loaded[i], cell_w, cell_h, detect_max_side, bbox, profiler)
+        loaded[i] = None
+    return cells
+
+def profiled_render_cells(jobs, detect_max_side=DETECT_MAX_SIDE):
+    """render_cells in a pool worker, returning (cells, spans) for the parent's Profiler."""
+    profiler = Profiler()
+    cells = render_cells(jobs, detect_max_side, profiler)
+    return cells, profiler.events
+
+def iter_cells(task_images, cell_sizes, workers=None, detect_max_side=DETECT_MAX_SIDE, lookahead=None, token=None,
+               batch=None, profiler=None):
+    """
+    Yields (index, cell_img) in input order, task_images[i] rendered at
+    cell_sizes[i]. Images go to render_cells in batches of up to `batch`
+    (default DETECT_BATCH). With more than one worker, batches are rendered in
+    the pool with at most `lookahead` (default: a batch, and at least 2 cells,
+    per worker) cells in flight, so
+    results arrive in order and memory stays bounded; the batch shrinks so
+    every worker still gets one. Stops early once `token` is cancelled,
+    withdrawing its queued batches so the shared pool is free for other tasks.
+    Stage timings go to `profiler` (a montage_profile.Profiler) if given.
+    """
+    workers = workers or RENDER_WORKERS
+    token = token or TaskToken()
+    batch = batch or DETECT_BATCH
+    lookahead = max(1, lookahead or workers*max(2, batch))
+    batch = max(1, min(batch, lookahead // workers))
+    jobs = [(img_path, *cell_sizes[idx]) for idx, img_path in enumerate(task_images)]
+    if workers <= 1:
+        for start in range(0, len(jobs), batch):
+            if not token.wait(): return
+            for offset, cell_img in enumerate(render_cells(jobs[start:start+batch], detect_max_side, profiler)):
+                yield start + offset, cell_img
+        return
+
+    pool = get_render_pool(workers)
+    pending = deque()
+    submitted = in_flight = 0
+    try:
+        while True:
+            # while paused nothing new is submitted; batches already in flight still finish
+            if not token.wait(): return
+            while submitted < len(jobs) and in_flight + batch <= lookahead:
+                chunk = jobs[submitted:submitted+batch]
+                if profiler:
+                    pending.append((submitted, pool.submit(profiled_render_cells, chunk, detect_max_side)))
+                else:
+                    pending.append((submitted, pool.submit(render_cells, chunk, detect_max_side)))
+                submitted += len(chunk)
+                in_flight += len(chunk)
+            if not pending: return
+            start, fut = pending.popleft()
+            cells = fut.result()
+            if profiler:
+                cells, events = cells
+                profiler.extend(events)
+            in_flight -= len(cells)
+            for offset, cell_img in enumerate(cells):
+                cells[offset] = None
+                yield start + offset, cell_img
+            del cells
+    finally:
+        for _, fut in pending:
+            fut.cancel()
+
+
+# ---------- Pages ----------
+def page_layout(page_size, rows, cols):
+    """The cached Layout for a grid on page_size with the current margin settings."""
+    return get_layout(tuple(page_size), rows, cols, GRID_MARGIN, MARGIN_OUTER, INNER_CELL_MARGIN)
+
+
+def iter_pages(cells, slots, progress_callback=None, profiler=None):
+    """
+    Assembles (index, cell_img) pairs into pages, slots[index] being the
+    (page_index, slot, layout) from montage_layout.iter_slots. Yields
+    (page_index, canvas) as soon as each page is full. Only one canvas is
+    alive at a time.
+    """
+    total = len(slots)
+    canvas = None
+    for idx, cell_img in cells:
+        pidx, i, layout = slots[idx]
+        if i == 0:
+            canvas = Image.new("RGB",layout.page_size,(255,255,255))
+        if cell_img is not None:
+            x, y, _, _ = layout.rect(i)
+            with span(profiler, "paste", page=pidx):
+                canvas.paste(cell_img, (x, y))
+
+            # Update progress bar for this task
+            if progress_callback:
+                progress_callback(idx + 1, total)
+
+        if i == layout.capacity - 1 or idx == total - 1:
+            page, canvas = canvas, None
+            yield pidx, page
+            del page  # don't keep the previous page alive while composing the next
+
+
+def normalize_format(fmt):
+    fmt = FORMAT_ALIASES.get((fmt or OUTPUT_FORMAT).lower(), (fmt or OUTPUT_FORMAT).lower())
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"unknown page format: {fmt}")
+    return fmt
+
+
+def page_save_options(fmt):
+    """PIL save() arguments for a page file in fmt (png, jpg or tif)."""
+    if fmt == "png":
+        return {"format": "PNG", "compress_level": PNG_COMPRESS_LEVEL, "dpi": (DPI, DPI)}
+    if fmt == "jpg":
+        return {"format": "JPEG", "quality": JPEG_QUALITY, "subsampling": 0, "dpi": (DPI, DPI)}
+    if fmt == "tif":
+        return {"format": "TIFF", "compression": TIFF_COMPRESSION, "dpi": (DPI, DPI)}
+    raise ValueError(f"no per-page file format: {fmt}")
+
+
+def output_settings(fmt):
+    """The settings that change how pages in fmt are encoded."""
+    settings = {"format": fmt, "dpi": DPI}
+    codec = PDF_IMAGE_CODEC if fmt == "pdf" else fmt
+    if fmt == "pdf":
+        settings["codec"] = codec
+    if codec in ("png", "flate"):
+        settings["png_level"] = PNG_COMPRESS_LEVEL
+    elif codec in ("jpg", "jpeg"):
+        settings["jpeg_quality"] = JPEG_QUALITY
+    elif codec == "tif":
+        settings["tiff_compression"] = TIFF_COMPRESSION
+    return settings
+
+
+class PdfDocument:
+    """
+    A PDF written one page at a time. Each page is a full-bleed image sized
+    from its pixels at dpi; only the object offsets are kept in memory.
+    """
+    def __init__(self, path, dpi=None):
+        self.path = path
+        self.dpi = dpi or DPI
+        self.offsets = {}
+        self.kids = []
+        self.next_obj = 3  # 1 = catalog, 2 = page tree, both written on close
+        self.f = open(path + ".part", "wb")  # renamed once complete
+        self.f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _obj(self, num, body, stream=None):
+        """Writes object num; returns the file offset of its stream data, if any."""
+        self.offsets[num] = self.f.tell()
+        self.f.write(b"%d 0 obj\n" % num + body)
+        offset = None
+        if stream is not None:
+            self.f.write(b"\nstream\n")
+            offset = self.f.tell()
+            self.f.write(stream + b"\nendstream")
+        self.f.write(b"\nendobj\n")
+        return offset
+
+    def add_image(self, data, width, height, pdf_filter, gray=False, decode_parms=b""):
+        """
+        Appends a page showing one image stream (/DCTDecode or /FlateDecode data).
+        Returns the offset of the image data in the file.
+        """
+        img, content, page = self.next_obj, self.next_obj + 1, self.next_obj + 2
+        self.next_obj += 3
+        w_pt, h_pt = width*72/self.dpi, height*72/self.dpi
+        offset = self._obj(img, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /%s "
+                                b"/BitsPerComponent 8 /Filter /%s %s/Length %d >>"
+                           % (width, height, b"DeviceGray" if gray else b"DeviceRGB", pdf_filter, decode_parms, len(data)), data)
+        ops = b"q %.4f 0 0 %.4f 0 0 cm /Im0 Do Q" % (w_pt, h_pt)
+        self._obj(content, b"<< /Length %d >>" % len(ops), ops)
+        self._obj(page, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] "
+                        b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+                  % (w_pt, h_pt, img, content))
+        self.kids.append(page)
+        return offset
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % k for k in self.kids)
+        self._obj(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.kids)))
+        self._obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref = self.f.tell()
+        self.f.write(b"xref\n0 %d\n0000000000 65535 f \n" % self.next_obj)
+        for num in range(1, self.next_obj):
+            self.f.write(b"%010d 00000 n \n" % self.offsets[num])
+        self.f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.next_obj, xref))
+        self.f.close()
+        os.replace(self.path + ".part", self.path)
+
+    def discard(self):
+        self.f.close()
+        remove_quietly(self.path + ".part")
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def png_idat(canvas, compress_level):
+    """
+    Encodes canvas as PNG and returns the concatenated IDAT payload: a zlib
+    stream of PNG-filtered rows, which PDF reads as /FlateDecode with predictor 15.
+    """
+    buf = io.BytesIO()
+    canvas.save(buf, "PNG", compress_level=compress_level)
+    data, pos, chunks = buf.getvalue(), 8, []
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos+4], "big")
+        if data[pos+4:pos+8] == b"IDAT":
+            chunks.append(data[pos+8:pos+8+length])
+        pos += 12 + length
+    return b"".join(chunks)
+
+
+# ---------- Page sinks ----------
+# A sink receives pages from PageWriter: encode(pidx, canvas) runs on writer
+# threads in any order, commit(pidx, encoded) runs in page order, and close()
+# finishes the output. commit/close return a saved file name to report, or None.
+# abort() replaces close() when the task is cancelled or fails, and removes
+# anything incomplete. Files are written under a .part name and renamed when
+# complete, so an interrupted run never leaves a truncated page behind.
+# With a TaskManifest, reusable(pidx, record) checks a page the last run
+# recorded against what is on disk, reuse(pidx, record) stands in for encode()
+# for such a page, and finished pages are recorded as they are committed.
+# A relocatable sink can reuse a recorded page at a different page index.
+class FilePageSink:
+    """One file per page, taskNN_page_NNN.<fmt>."""
+    relocatable = False
+
+    def __init__(self, dest_dir, task_index, fmt, manifest=None):
+        self.dest_dir = dest_dir
+        self.task_index = task_index
+        self.fmt = fmt
+        self.options = page_save_options(fmt)
+        self.manifest = manifest
+        self.outputs = []
+
+    def page_name(self, pidx):
+        return os.path.join(self.dest_dir, f"task{self.task_index:02d}_page_{pidx+1:03d}.{self.fmt}")
+
+    def _record(self, out_name):
+        st = os.stat(out_name)
+        return {"file": os.path.basename(out_name), "bytes": st.st_size, "mtime_ns": st.st_mtime_ns,
+                "digest": montage_cache.file_digest(out_name)}
+
+    def encode(self, pidx, canvas):
+        out_name = self.page_name(pidx)
+        try:
+            canvas.save(out_name + ".part", **self.options)
+            os.replace(out_name + ".part", out_name)
+        except BaseException:
+            remove_quietly(out_name + ".part")
+            raise
+        return out_name, self._record(out_name) if self.manifest else None
+
+    def reusable(self, pidx, record):
+        out_name = self.page_name(pidx)
+        try:
+            st = os.stat(out_name)
+            if record["file"] != os.path.basename(out_name) or st.st_size != record["bytes"]:
+                return False
+            # same size and mtime as when it was written: trusted like the detection cache's digests
+            return st.st_mtime_ns == record["mtime_ns"] or montage_cache.file_digest(out_name) == record["digest"]
+        except (OSError, KeyError, TypeError):
+            return False
+
+    def reuse(self, pidx, record):
+        out_name = self.page_name(pidx)
+        return out_name, dict(record, mtime_ns=os.stat(out_name).st_mtime_ns)
+
+    def commit(self, pidx, encoded):
+        out_name, record = encoded
+        self.outputs.append(out_name)
+        if self.manifest:
+            self.manifest.record(pidx, record)
+            self.manifest.checkpoint()
+        return out_name
+
+    def close(self):
+        if self.manifest:
+            # pages past the end of a task that got shorter
+            for pidx, record in self.manifest.previous.items():
+                if pidx >= len(self.outputs) and record.get("file") == os.path.basename(self.page_name(pidx)):
+                    remove_quietly(self.page_name(pidx))
+            self.manifest.finish([os.path.basename(name) for name in self.outputs])
+        return None
+
+    def abort(self):
+        # finished pages stay and are recorded for the next run; nothing partial is left
+        if self.manifest:
+            self.manifest.checkpoint(force=True)
+        return None
+
+
+class PdfPageSink:
+    """
+    All pages appended to one PDF as soon as they are encoded, so a task of any
+    length only has the pages in the writer pipeline in memory. Page images are
+    JPEG (/DCTDecode, JPEG_QUALITY) or lossless Flate (PNG_COMPRESS_LEVEL).
+    With a manifest, reused pages have their image stream copied from the last
+    run's PDF, or from its interrupted .part, whichever page they were on; a
+    cancelled run keeps its .part.
+    """
+    relocatable = True
+
+    def __init__(self, path, codec=None, dpi=None, manifest=None):
+        self.codec = codec or PDF_IMAGE_CODEC
+        if self.codec not in ("jpeg", "flate"):
+            raise ValueError(f"unknown PDF image codec: {self.codec}")
+        self.path = path
+        self.dpi = dpi
+        self.doc = None  # opened with the first page, so an up-to-date PDF is never rewritten
+        self.manifest = manifest
+        self.source = None
+        if manifest and manifest.previous:
+            if manifest.previous_complete:
+                self.source = path
+            elif os.path.exists(path + ".part"):
+                # the new document is written to .part, so move the checkpoint aside first
+                self.source = path + ".resume"
+                os.replace(path + ".part", self.source)
+        self.outputs = [path]
+
+    def page_name(self, pidx):
+        return self.path
+
+    def _document(self):
+        if self.doc is None:
+            self.doc = PdfDocument(self.path, self.dpi)
+        return self.doc
+
+    def encode(self, pidx, canvas):
+        gray = canvas.mode == "L"
+        if self.codec == "jpeg":
+            buf = io.BytesIO()
+            canvas.save(buf, "JPEG", quality=JPEG_QUALITY, subsampling=0)
+            data, pdf_filter, parms = buf.getvalue(), b"DCTDecode", b""
+        else:
+            parms = b"/DecodeParms << /Predictor 15 /Colors %d /BitsPerComponent 8 /Columns %d >> " % (1 if gray else 3, canvas.width)
+            data, pdf_filter = png_idat(canvas, PNG_COMPRESS_LEVEL), b"FlateDecode"
+        return data, canvas.size, pdf_filter, gray, parms, bytes_digest(data) if self.manifest else None
+
+    def _read_stream(self, record):
+        offset, length = record["stream"]
+        with open(self.source, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def reusable(self, pidx, record):
+        try:
+            return self.source is not None and bytes_digest(self._read_stream(record)) == record["digest"]
+        except (OSError, KeyError, TypeError, ValueError):
+            return False
+
+    def reuse(self, pidx, record):
+        return (self._read_stream(record), tuple(record["size"]), record["filter"].encode(), record["gray"],
+                record["parms"].encode(), record["digest"])
+
+    def commit(self, pidx, encoded):
+        data, (w, h), pdf_filter, gray, parms, digest = encoded
+        offset = self._document().add_image(data, w, h, pdf_filter, gray, parms)
+        if self.manifest:
+            self.manifest.record(pidx, {"stream": [offset, len(data)], "size": [w, h], "filter": pdf_filter.decode(),
+                                        "gray": gray, "parms": parms.decode(), "digest": digest})
+            self.manifest.checkpoint(before=self.doc.flush)
+        return None
+
+    def close(self):
+        self._document().close()
+        if self.source and self.source != self.path:
+            remove_quietly(self.source)
+        if self.manifest:
+            self.manifest.finish([os.path.basename(self.path)])
+        return self.path
+
+    def abort(self):
+        if self.doc is None:
+            if self.source and self.source != self.path:
+                os.replace(self.source, self.path + ".part")  # untouched checkpoint, still described by the manifest
+        elif self.manifest:
+            # what was written so far stays as the checkpoint for the next run
+            self.manifest.checkpoint(force=True, before=self.doc.flush)
+            self.doc.f.close()
+            if self.source and self.source != self.path:
+                remove_quietly(self.source)
+        else:
+            self.doc.discard()
+        self.outputs = []
+
+
+def open_page_sink(fmt, dest_dir, task_index, manifest=None):
+    """The sink make_pages uses for fmt: a PDF per task for "pdf", else a file per page."""
+    if fmt == "pdf":
+        return PdfPageSink(os.path.join(dest_dir, f"task{task_index:02d}.pdf"), manifest=manifest)
+    return FilePageSink(dest_dir, task_index, fmt, manifest)
+
+
+class PageWriter:
+    """
+    Encodes pages on `workers` threads fed by a bounded queue, so the next page
+    is composed while earlier ones are encoded (PIL's encoders and zlib release
+    the GIL). put() blocks when full. Canvases are dropped as soon as they are
+    encoded; the sink commits pages strictly in order. on_saved(out_name) is
+    called from a writer thread for every file the sink reports, on_page(pidx)
+    for every page committed (pages of a PDF too). reuse() queues a page the
+    sink takes over from the previous run instead of encoding it.
+    """
+    def __init__(self, sink, max_pending=1, on_saved=None, workers=1, profiler=None, on_page=None):
+        self.sink = sink
+        self.profiler = profiler
+        self.on_page = on_page
+        self.queue = queue.Queue(maxsize=max(1, max_pending))
+        self.on_saved = on_saved
+        self.error = None
+        self.aborted = False
+        self._next = 0
+        self._ready = {}
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(max(1, workers))]
+        for t in self.threads:
+            t.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None: break
+            pidx, canvas, record = item
+            del item
+            if self.error is None and not self.aborted:
+                try:
+                    with span(self.profiler, "reuse" if canvas is None else "encode", page=pidx):
+                        encoded = self.sink.reuse(pidx, record) if canvas is None else self.sink.encode(pidx, canvas)
+                    del canvas
+                    self._commit(pidx, encoded)
+                except Exception as e:
+                    self.error = e
+
+    def _commit(self, pidx, encoded):
+        with self._lock:
+            self._ready[pidx] = encoded
+            while self._next in self._ready:
+                with span(self.profiler, "commit", page=self._next):
+                    saved = self.sink.commit(self._next, self._ready.pop(self._next))
+                if self.on_page:
+                    self.on_page(self._next)
+                self._next += 1
+                if saved and self.on_saved:
+                    self.on_saved(saved)
+
+    def put(self, pidx, canvas):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((pidx, canvas, None))
+
+    def reuse(self, pidx, record):
+        """Queues page pidx to be taken from the previous run's output (see the manifest)."""
+        if self.error is not None:
+            raise self.error
+        self.queue.put((pidx, None, record))
+
+    def close(self, abort=False):
+        """
+        Waits for queued pages and finishes the sink. With abort=True queued pages
+        are dropped and the sink removes its incomplete output instead.
+        """
+        self.aborted = abort
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        if abort or self.error is not None:
+            self.sink.abort()
+        else:
+            saved = self.sink.close()
+            if saved and self.on_saved:
+                self.on_saved(saved)
+        if self.error is not None and not abort:
+            raise self.error
+
+
+def memory_plan(workers, cell_w, cell_h, page_size, memory_mb=None):
+    """
+    Splits the RENDER_MEMORY_MB ceiling between cells in flight, pages queued
+    for writing and pages being encoded. Returns (cell_lookahead, pages_pending, writers).
+    """
+    budget = (memory_mb or RENDER_MEMORY_MB) * 2**20
+    page_bytes = page_size[0]*page_size[1]*3
+    # A cell in flight holds its decode (up to ~4x the cell after draft), its detection plane and the result
+    cell_bytes = cell_w*cell_h*3*6
+    pages_pending = 1 if budget < 4*page_bytes else 2
+    # Keep at least half the budget for composing and rendering cells
+    writers = int(max(1, min(WRITE_WORKERS, budget // (2*page_bytes) - pages_pending - 1)))
+    budget -= (pages_pending + writers + 1)*page_bytes
+    lookahead = int(min(workers*max(2, DETECT_BATCH), max(1, budget // cell_bytes)))
+    return lookahead, pages_pending, writers
+
+
+def task_settings(task_images, layouts, fmt, detect_max_side=DETECT_MAX_SIDE):
+    """Everything a task's pages depend on, as recorded in its manifest."""
+    return {"inputs": [fingerprint(path) for path in task_images],
+            "layouts": [l.signature() for l in layouts],
+            "detector": detector_signature(detect_max_side),
+            "output": output_settings(fmt)}
+
+
+def reusable_pages(sink, manifest):
+    """
+    page index -> the previous run's record to reuse for it: the dependency
+    digest is unchanged and the output is still intact. Relocatable sinks may
+    take a page the previous run had at another index (images were added or
+    removed earlier in the task).
+    """
+    by_deps = {}
+    if sink.relocatable:
+        for _, record in sorted(manifest.previous.items()):
+            by_deps.setdefault(record.get("deps"), record)
+    kept = {}
+    for pidx, deps in enumerate(manifest.deps):
+        record = manifest.previous.get(pidx)
+        if not (record and record.get("deps") == deps):
+            record = by_deps.get(deps)
+        if record and sink.reusable(pidx, record):
+            kept[pidx] = record
+    return kept
+
+
+def make_pages(task_images, page_size, rows, cols, dest_dir, progress_callback, task_index, workers=None, memory_mb=None,
+               fmt=None, page_callback=None, detect_max_side=DETECT_MAX_SIDE, sink=None, layout=None, token=None,
+               resume=None, profiler=None, pages_callback=None):
+    """
+    Streams task_images through cell rendering -> page assembly -> page writer.
+    Every stage is bounded, so peak memory doesn't grow with the task size.
+    Returns the files written (page files, or the one PDF); page_callback(out_name)
+    fires as each is saved, pages_callback(done, total) as each page is
+    written (or kept). fmt defaults to OUTPUT_FORMAT; pass `sink` to
+    send the pages somewhere else (see FilePageSink / PdfPageSink).
+    `layout` (a Layout, or a list used page by page with the last repeating)
+    replaces page_size/rows/cols; cols may also be a tuple of per-row counts.
+    `token` (a TaskToken) pauses or cancels the run; a cancelled run removes
+    its incomplete output and raises TaskCancelled.
+    Unless `resume` (default RESUME) is False, the run keeps a manifest in
+    dest_dir, and pages a previous run finished from the same images, layout
+    and settings, and that are still intact, are kept instead of rendered again.
+    `profiler` (a montage_profile.Profiler) records how long every stage takes.
+    """
+    with span(profiler, TASK, task=task_index):
+        workers = workers or RENDER_WORKERS
+        token = token or TaskToken()
+        if not token.wait():
+            raise TaskCancelled(f"task {task_index} cancelled")
+        layouts = layout or page_layout(page_size, rows, cols)
+        layouts = [layouts] if isinstance(layouts, Layout) else list(layouts)
+        slots = list(iter_slots(len(task_images), layouts))
+        page_total = slots[-1][0] + 1 if slots else 0
+        os.makedirs(dest_dir, exist_ok=True)
+
+        manifest = None
+        if sink is None:
+            fmt = normalize_format(fmt)
+            if RESUME if resume is None else resume:
+                settings = task_settings(task_images, layouts, fmt, detect_max_side)
+                deps = page_digests(settings["inputs"], slots, [settings["detector"], settings["output"]])
+                manifest = TaskManifest(manifest_path(dest_dir, task_index), settings, deps)
+            sink = open_page_sink(fmt, dest_dir, task_index, manifest)
+        kept = reusable_pages(sink, manifest) if manifest else {}
+        if (manifest and manifest.previous_complete and len(manifest.previous) == page_total
+                and all(kept.get(pidx) is manifest.previous.get(pidx) for pidx in range(page_total))):
+            # the last run finished with the same pages, and its output is intact
+            outputs = [os.path.join(dest_dir, name) for name in manifest.previous_outputs]
+            if progress_callback and task_images:
+                progress_callback(len(task_images), len(task_images))
+            if pages_callback and page_total:
+                pages_callback(page_total, page_total)
+            for out_name in outputs:
+                if page_callback: page_callback(out_name)
+            return outputs
+
+        render = [idx for idx, (pidx, _, _) in enumerate(slots) if pidx not in kept]
+        area = lambda size: size[0]*size[1]
+        cell_w, cell_h = max((l.max_cell_size() for l in layouts), key=area)
+        max_page = max((l.page_size for l in layouts), key=area)
+        lookahead, pages_pending, writers = memory_plan(workers, cell_w, cell_h, max_page, memory_mb)
+        cells = iter_cells([task_images[idx] for idx in render], [slots[idx][2].cell_size(slots[idx][1]) for idx in render],
+                           workers, detect_max_side, lookahead, token, profiler=profiler)
+        on_page = (lambda pidx: pages_callback(pidx + 1, page_total)) if pages_callback else None
+        writer = PageWriter(sink, pages_pending, page_callback, writers, profiler, on_page)
+        reuse = deque(sorted(kept))
+        try:
+            for pidx, canvas in iter_pages(((render[j], cell) for j, cell in cells), slots, progress_callback,
+                                            profiler):
+                if not token.wait(): break
+                while reuse and reuse[0] < pidx:
+                    writer.reuse(reuse[0], kept[reuse.popleft()])
+                writer.put(pidx, canvas)
+                del canvas
+            else:
+                while reuse:
+                    writer.reuse(reuse[0], kept[reuse.popleft()])
+        except BaseException:
+            cells.close()
+            writer.close(abort=True)
+            raise
+        cells.close()
+        writer.close(abort=token.cancelled)
+        if token.cancelled:
+            raise TaskCancelled(f"task {task_index} cancelled")
+        if kept and progress_callback:
+            progress_callback(len(task_images), len(task_images))
+        return sink.outputs
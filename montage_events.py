@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+montage_events.py
+
+One channel from task threads to a GUI thread, so a fast run can't flood
+the UI with one callback per image.
+
+- Progress (images done, pages written) only updates per-task counters;
+  the UI polls at most POLL_HZ times a second and gets one snapshot per
+  task that changed, with images/s over the last RATE_WINDOW seconds and
+  an ETA, plus the same for all running tasks together
+- Callbacks posted with post() (e.g. TaskScheduler's on_start / on_done)
+  are never coalesced and run in order, before the progress snapshots
+- Safe to call from any thread; poll() belongs to the UI thread
+"""
+
+import time
+import threading
+from collections import deque
+
+# ---------- Config ----------
+POLL_HZ = 10
+RATE_WINDOW = 5.0  # seconds of progress images/s is measured over
+# ----------------------------
+
+
+class _TaskState:
+    __slots__ = ("images_done", "images_total", "pages_done", "pages_total", "started", "samples")
+
+    def __init__(self, images_total, now):
+        self.images_done = 0
+        self.images_total = images_total
+        self.pages_done = 0
+        self.pages_total = 0
+        self.started = now
+        self.samples = deque([(now, 0)])  # (time, images_done), oldest first
+
+
+class ProgressBus:
+    def __init__(self, poll_hz=POLL_HZ, rate_window=RATE_WINDOW):
+        self.interval_ms = max(1, int(1000 / poll_hz))
+        self.rate_window = rate_window
+        self._lock = threading.Lock()
+        self._calls = deque()
+        self._tasks = {}
+        self._changed = set()
+
+    # ---------- Task threads ----------
+    def post(self, fn):
+        """Runs fn() on the UI thread at the next poll."""
+        self._calls.append(fn)
+
+    def start(self, key, images_total):
+        """A task (any hashable key) begins; its rate and ETA are measured from now."""
+        with self._lock:
+            self._tasks[key] = _TaskState(images_total, time.monotonic())
+            self._changed.add(key)
+
+    def images(self, key, done, total):
+        now = time.monotonic()
+        with self._lock:
+            state = self._tasks.get(key)
+            if state is None:
+                return
+            state.images_done, state.images_total = done, total
+            state.samples.append((now, done))
+            # keep one sample at or before the window start
+            while len(state.samples) > 2 and state.samples[1][0] <= now - self.rate_window:
+                state.samples.popleft()
+            self._changed.add(key)
+
+    def pages(self, key, done, total):
+        with self._lock:
+            state = self._tasks.get(key)
+            if state is None:
+                return
+            state.pages_done, state.pages_total = done, total
+            self._changed.add(key)
+
+    def finish(self, key):
+        """The task ended (done, failed or cancelled); it gets no more snapshots."""
+        with self._lock:
+            self._tasks.pop(key, None)
+            self._changed.discard(key)
+            self._changed.add(None)  # the overall numbers changed
+
+    # ---------- UI thread ----------
+    def poll(self):
+        """
+        Returns (calls, snapshots, overall): the posted callbacks in order,
+        {key: snapshot} for the running tasks that changed since the last
+        poll, and a snapshot of all running tasks together (None when none
+        are running).
+        """
+        calls = []
+        while self._calls:
+            calls.append(self._calls.popleft())
+        now = time.monotonic()
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            snapshots = {key: self._snapshot(self._tasks[key], now) for key in changed if key in self._tasks}
+            overall = self._overall([self._snapshot(state, now) for state in self._tasks.values()])
+        return calls, snapshots, overall
+
+    def _snapshot(self, state, now):
+        t0, done0 = state.samples[0]
+        elapsed = now - t0
+        rate = (state.images_done - done0) / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, state.images_total - state.images_done)
+        return {"images_done": state.images_done, "images_total": state.images_total,
+                "pages_done": state.pages_done, "pages_total": state.pages_total,
+                "images_per_s": rate, "eta_s": remaining / rate if rate > 0 else None,
+                "elapsed_s": now - state.started}
+
+    @staticmethod
+    def _overall(snapshots):
+        if not snapshots:
+            return None
+        total = {field: sum(s[field] for s in snapshots)
+                 for field in ("images_done", "images_total", "pages_done", "pages_total", "images_per_s")}
+        remaining = max(0, total["images_total"] - total["images_done"])
+        rate = total["images_per_s"]
+        total["eta_s"] = remaining / rate if rate > 0 else None
+        total["elapsed_s"] = max(s["elapsed_s"] for s in snapshots)
+        total["tasks"] = len(snapshots)
+        return total
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(round(seconds))
+    h, rem = divmod(seconds, 3600)
+    return f"{h}:{rem // 60:02d}:{rem % 60:02d}" if h else f"{rem // 60}:{rem % 60:02d}"
+
+
+def describe(snapshot):
+    """'12/40 images | 3/10 pages | 2.1 img/s | ETA 0:13' for a task or overall snapshot."""
+    parts = [f"{snapshot['images_done']}/{snapshot['images_total']} images"]
+    if snapshot["pages_total"]:
+        parts.append(f"{snapshot['pages_done']}/{snapshot['pages_total']} pages")
+    parts.append(f"{snapshot['images_per_s']:.1f} img/s")
+    parts.append(f"ETA {format_eta(snapshot['eta_s'])}")
+    return " | ".join(parts)
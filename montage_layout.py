@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+montage_layout.py
+
+Page geometry shared by the engine, the GUIs, the CLI and the core script.
+
+- A Layout is built once per (page size, grid, margins) and never changes
+- Cell rectangles are precomputed into one flat array (x, y, w, h per cell)
+- Rows may have different column counts ("mixed" grids, e.g. 2 then 3)
+- get_layout() caches layouts, so a batch of tasks with the same settings
+  shares one instance
+- A task can use a different layout per page; the last one repeats
+"""
+
+import array
+import functools
+
+
+class Layout:
+    """
+    Cell rectangles of one page, in fill order (left to right, top to bottom).
+    cols is an int, or a tuple with one column count per row.
+    """
+    __slots__ = ("page_size", "rows", "cols", "margins", "rects", "capacity")
+
+    def __init__(self, page_size, rows, cols, grid_margin, outer_margin, inner_margin):
+        page_w, page_h = page_size
+        row_cols = (cols,) * rows if isinstance(cols, int) else tuple(cols)
+        if rows < 1 or len(row_cols) != rows or min(row_cols) < 1:
+            raise ValueError(f"bad grid: {rows} rows, columns {cols}")
+
+        TOTAL_V_MARGIN = (rows - 1) * grid_margin + 2 * outer_margin + 2 * inner_margin * rows
+        cell_h = (page_h - TOTAL_V_MARGIN) // rows
+        rects = array.array("i")
+        for row, n in enumerate(row_cols):
+            TOTAL_H_MARGIN = (n - 1) * grid_margin + 2 * outer_margin + 2 * inner_margin * n
+            cell_w = (page_w - TOTAL_H_MARGIN) // n
+            if cell_w < 1 or cell_h < 1:
+                raise ValueError(f"margins leave no room for a {rows}x{n} grid on a {page_w}x{page_h} page")
+            y = outer_margin + row*(cell_h + grid_margin + 2*inner_margin) + inner_margin
+            for col in range(n):
+                x = outer_margin + col*(cell_w + grid_margin + 2*inner_margin) + inner_margin
+                rects.extend((x, y, cell_w, cell_h))
+
+        for name, value in (("page_size", (page_w, page_h)), ("rows", rows),
+                            ("cols", cols if isinstance(cols, int) else row_cols),
+                            ("margins", (grid_margin, outer_margin, inner_margin)),
+                            ("rects", rects), ("capacity", len(rects) // 4)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Layout is immutable")
+
+    def __repr__(self):
+        return f"Layout(page_size={self.page_size}, rows={self.rows}, cols={self.cols}, margins={self.margins})"
+
+    def rect(self, slot):
+        """(x, y, w, h) of cell `slot` on the page."""
+        i = slot * 4
+        return tuple(self.rects[i:i+4])
+
+    def cell_size(self, slot):
+        i = slot * 4
+        return self.rects[i+2], self.rects[i+3]
+
+    def max_cell_size(self):
+        return max(self.rects[2::4]), max(self.rects[3::4])
+
+    def signature(self):
+        """Plain values that identify the layout, e.g. in a task manifest."""
+        return self.page_size, self.rows, self.cols, self.margins
+
+
+@functools.lru_cache(maxsize=64)
+def get_layout(page_size, rows, cols, grid_margin, outer_margin, inner_margin):
+    """Cached Layout; arguments must be hashable (tuples for page_size / per-row cols)."""
+    return Layout(tuple(page_size), rows, cols if isinstance(cols, int) else tuple(cols),
+                  grid_margin, outer_margin, inner_margin)
+
+
+def parse_grid(text):
+    """'RxC' (e.g. 2x2) or per-row column counts joined by '+' (e.g. 2+3) -> (rows, cols)."""
+    text = text.strip().lower()
+    try:
+        if "x" in text:
+            rows, cols = text.split("x")
+            return int(rows), int(cols)
+        row_cols = tuple(int(n) for n in text.split("+"))
+        return len(row_cols), row_cols
+    except ValueError:
+        raise ValueError(f"bad grid: {text} (use RxC or per-row counts like 2+3)")
+
+
+def iter_slots(total, layouts):
+    """
+    Yields (page_index, slot, layout) for images 0..total-1, filling each
+    page's layout in turn; the last layout repeats for the remaining pages.
+    """
+    if isinstance(layouts, Layout):
+        layouts = [layouts]
+    pidx = slot = 0
+    layout = layouts[0]
+    for _ in range(total):
+        yield pidx, slot, layout
+        slot += 1
+        if slot == layout.capacity:
+            pidx, slot = pidx + 1, 0
+            layout = layouts[min(pidx, len(layouts) - 1)]
+
+
+def page_count(total, layouts):
+    if isinstance(layouts, Layout):
+        layouts = [layouts]
+    pages = 0
+    while total > 0:
+        total -= layouts[min(pages, len(layouts) - 1)].capacity
+        pages += 1
+    return pages
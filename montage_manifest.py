@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+montage_manifest.py
+
+Checkpoint manifest kept next to a task's pages, so re-running an
+interrupted (or finished) task only renders what is missing.
+
+- One JSON file per task: taskNN.manifest.json in the destination folder
+- Records what the pages depend on: inputs (path, size, mtime), layouts,
+  detector and output settings
+- Records every finished page with a checksum (the page file, or where its
+  image stream sits inside the PDF) and a digest of its own dependencies
+- Rewritten atomically, at most every CHECKPOINT_SECONDS and when a run ends
+- A page from the last run is reused when its dependency digest is unchanged,
+  so editing a task only re-renders the pages whose images moved or changed
+
+  python montage_manifest.py out/task01.manifest.json
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+
+# ---------- Config ----------
+MANIFEST_VERSION = 2
+CHECKPOINT_SECONDS = 2.0
+# ----------------------------
+
+
+def manifest_path(dest_dir, task_index):
+    return os.path.join(dest_dir, f"task{task_index:02d}.manifest.json")
+
+
+def fingerprint(path):
+    """[absolute path, size, mtime_ns]; size and mtime are None if the file can't be read."""
+    path = os.path.abspath(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, st.st_size, st.st_mtime_ns]
+
+
+def bytes_digest(data):
+    """Same digest as montage_cache.file_digest, for data already in memory."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def page_digests(inputs, slots, shared):
+    """
+    One digest per page of everything the page depends on: the fingerprints of
+    its inputs in order, its layout and `shared` (detector / output settings).
+    slots are the (page_index, slot, layout) of montage_layout.iter_slots.
+    """
+    pages = []
+    for fp, (pidx, _, layout) in zip(inputs, slots):
+        if pidx == len(pages):
+            pages.append([shared, layout.signature(), []])
+        pages[pidx][2].append(fp)
+    return [bytes_digest(json.dumps(page).encode()) for page in pages]
+
+
+class TaskManifest:
+    """
+    Manifest of one run. `deps` holds the dependency digest of each page of
+    this run. `previous` maps page index -> record (with its "deps") for the
+    pages the last run finished; the caller matches digests and checks the
+    output on disk before reusing one.
+    """
+    def __init__(self, path, settings, deps):
+        self.path = path
+        self.settings = settings
+        self.deps = deps
+        self.pages = {}
+        self.outputs = []
+        self.complete = False
+        self.previous = {}
+        self.previous_complete = False
+        self.previous_outputs = []
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        old = self.load(path)
+        if old and old.get("version") == MANIFEST_VERSION:
+            self.previous = {int(pidx): record for pidx, record in old.get("pages", {}).items()}
+            self.previous_complete = bool(old.get("complete"))
+            self.previous_outputs = old.get("outputs", [])
+
+    @staticmethod
+    def load(path):
+        """The manifest at path as a dict, or None if it is missing or unreadable."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data if isinstance(data, dict) else None
+
+    def record(self, pidx, record):
+        with self._lock:
+            self.pages[pidx] = dict(record, deps=self.deps[pidx])
+
+    def checkpoint(self, force=False, before=None):
+        """
+        Saves if forced or CHECKPOINT_SECONDS have passed since the last save.
+        before() runs first (e.g. flushing the output the records point into).
+        """
+        if not force and time.monotonic() - self._saved_at < CHECKPOINT_SECONDS:
+            return
+        if before:
+            before()
+        self.save()
+
+    def finish(self, outputs):
+        self.complete = True
+        self.outputs = list(outputs)
+        self.save()
+
+    def save(self):
+        with self._lock:
+            data = {"version": MANIFEST_VERSION, "complete": self.complete, "outputs": self.outputs,
+                    "settings": self.settings, "pages": {str(p): r for p, r in sorted(self.pages.items())}}
+            part = self.path + ".part"
+            try:
+                with open(part, "w", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(",", ":"))
+                os.replace(part, self.path)
+            except OSError as e:
+                # the run itself is fine; only resuming it later won't be
+                print(f"Warning: could not save {self.path}: {e}")
+            self._saved_at = time.monotonic()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: montage_manifest.py TASK_MANIFEST_JSON")
+        return 2
+    data = TaskManifest.load(argv[0])
+    if data is None:
+        print(f"{argv[0]}: no readable manifest")
+        return 1
+    settings = data.get("settings", {})
+    print(f"version:  {data.get('version')}")
+    print(f"complete: {data.get('complete')}")
+    print(f"inputs:   {len(settings.get('inputs', []))}")
+    print(f"detector: {settings.get('detector')}")
+    print(f"output:   {settings.get('output')}")
+    print(f"pages:    {len(data.get('pages', {}))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+montage_profile.py
+
+Optional stage timings for make_pages (see montage_engine).
+
+- Off unless a Profiler is passed in (make_pages(profiler=...), montage_cli
+  --profile, PROFILE in the engine config for the GUIs); when off every hook
+  is one shared no-op context manager
+- Spans per image: decode, cache, planes, faces (per batch), subject, crop,
+  resize (render workers send theirs back with the cells), paste
+- Spans per page: encode, commit; one "task" span around the whole run
+- Exports a JSONL trace (one span per line) or a Chrome trace-event file
+  (chrome://tracing, ui.perfetto.dev)
+- summary() gives count / total / p50 / p95 per stage
+
+  python montage_profile.py out/task01.trace.json     (stage summary of a saved trace)
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import contextlib
+import threading
+
+# Timestamps are time.perf_counter(), which is a system-wide monotonic clock
+# on Linux, macOS and Windows, so spans from render workers line up with the
+# parent's.
+TASK = "task"
+NO_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start, time.perf_counter(), **self.args)
+        return False
+
+
+def span(profiler, name, **args):
+    """A context manager timing `name` into profiler, or a no-op when profiler is None."""
+    return NO_SPAN if profiler is None else _Span(profiler, name, args)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(len(values) * q / 100) - 1))]
+
+
+class Profiler:
+    """
+    Collects spans as (name, start, end, pid, tid, args) tuples. Safe to use
+    from several threads; spans recorded in another process are merged with
+    extend().
+    """
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter()
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def add(self, name, start, end, **args):
+        self.events.append((name, start, end, os.getpid(), threading.get_ident(), args))
+
+    def extend(self, events):
+        self.events.extend(events)
+
+    def stage_times(self):
+        """{stage: [seconds, ...]} in the order stages first occur."""
+        times = {}
+        for name, start, end, *_ in self.events:
+            times.setdefault(name, []).append(end - start)
+        return times
+
+    def summary(self):
+        return {name: {"count": len(t), "total_s": round(sum(t), 4), "p50_ms": round(percentile(t, 50)*1000, 2),
+                       "p95_ms": round(percentile(t, 95)*1000, 2)}
+                for name, t in self.stage_times().items()}
+
+    def summary_text(self, top=4):
+        """One line for a task card: wall time, then the stages taking the most time."""
+        times = {name: sum(t) for name, t in self.stage_times().items()}
+        wall = times.pop(TASK, None)
+        spent = sum(times.values())
+        if not spent:
+            return ""
+        shares = sorted(times.items(), key=lambda kv: -kv[1])[:top]
+        text = ", ".join(f"{name} {seconds/spent:.0%}" for name, seconds in shares)
+        return f"{wall:.1f}s: {text}" if wall else text
+
+    # ---------- Export ----------
+    def write(self, path):
+        """Chrome trace-event JSON, or JSONL when path ends in .jsonl."""
+        part = path + ".part"
+        with open(part, "w", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                self._write_jsonl(f)
+            else:
+                json.dump(self.chrome_trace(), f)
+        os.replace(part, path)
+
+    def _write_jsonl(self, f):
+        for name, start, end, pid, tid, args in self.events:
+            f.write(json.dumps({"name": name, "start": round(start - self.origin, 6),
+                                "seconds": round(end - start, 6), "pid": pid, "tid": tid, "args": args}) + "\n")
+
+    def chrome_trace(self):
+        main = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                   "args": {"name": "montage" if pid == main else f"render worker {pid}"}}
+                  for pid in sorted({e[3] for e in self.events})]
+        events.extend({"name": name, "cat": "montage", "ph": "X", "ts": round((start - self.origin)*1e6, 1),
+                       "dur": round((end - start)*1e6, 1), "pid": pid, "tid": tid, "args": args}
+                      for name, start, end, pid, tid, args in self.events)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    @classmethod
+    def load(cls, path):
+        """A Profiler holding the spans of a trace written by write()."""
+        profiler = cls()
+        profiler.origin = 0.0
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                for line in f:
+                    e = json.loads(line)
+                    profiler.add_event(e["name"], e["start"], e["start"] + e["seconds"], e["pid"], e["tid"], e["args"])
+            else:
+                for e in json.load(f)["traceEvents"]:
+                    if e.get("ph") == "X":
+                        profiler.add_event(e["name"], e["ts"]/1e6, (e["ts"] + e["dur"])/1e6, e["pid"], e["tid"],
+                                           e.get("args", {}))
+        return profiler
+
+    def add_event(self, name, start, end, pid, tid, args):
+        self.events.append((name, start, end, pid, tid, args))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: montage_profile.py TRACE(.json|.jsonl)")
+        return 2
+    try:
+        profiler = Profiler.load(argv[0])
+    except (OSError, ValueError, KeyError) as e:
+        print(f"{argv[0]}: not a readable trace ({e})")
+        return 1
+    print(f"{'stage':<10}{'count':>7}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, s in profiler.summary().items():
+        print(f"{name:<10}{s['count']:>7}{s['total_s']:>10.3f}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}")
+    print(profiler.summary_text())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
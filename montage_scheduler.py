@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+montage_scheduler.py
+
+Runs montage tasks from a priority queue with a fixed number of tasks in
+flight. Tasks share montage_engine's render pool; callbacks are handed to
+`dispatch` so a GUI can run them on its own thread.
+"""
+
+import heapq
+import itertools
+import threading
+
+# ---------- Config ----------
+MAX_CONCURRENT_TASKS = 2
+# ----------------------------
+
+
+class TaskScheduler:
+    def __init__(self, max_concurrent=MAX_CONCURRENT_TASKS, dispatch=None, on_idle=None):
+        """
+        dispatch(fn) must arrange for fn() to run on the caller's UI thread;
+        by default callbacks run on the scheduler thread. on_idle fires when
+        the queue drains and nothing is running.
+        """
+        self.dispatch = dispatch or (lambda fn: fn())
+        self.on_idle = on_idle
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._threads = [threading.Thread(target=self._loop, daemon=True) for _ in range(max(1, max_concurrent))]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, job, priority=0, on_start=None, on_done=None):
+        """
+        Queues job() to run on a scheduler thread. Lower priority values run
+        first; equal priorities run in submission order. on_done(result, error)
+        is dispatched when the job finishes.
+        """
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._seq), job, on_start, on_done))
+            self._cond.notify()
+
+    def cancel_pending(self):
+        """Drops queued jobs that haven't started; running ones are unaffected."""
+        with self._cond:
+            self._heap.clear()
+            idle = self._running == 0
+        if idle and self.on_idle:
+            self.dispatch(self.on_idle)
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def running(self):
+        with self._cond:
+            return self._running
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job, on_start, on_done = heapq.heappop(self._heap)
+                self._running += 1
+            if on_start:
+                self.dispatch(on_start)
+            result = error = None
+            try:
+                result = job()
+            except Exception as e:
+                error = e
+            if on_done:
+                self.dispatch(lambda f=on_done, r=result, e=error: f(r, e))
+            with self._cond:
+                self._running -= 1
+                idle = self._running == 0 and not self._heap
+            if idle and self.on_idle:
+                self.dispatch(self.on_idle)
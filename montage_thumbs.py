@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+montage_thumbs.py
+
+Thumbnail grid used by the task setup dialogs.
+
+- Thumbnails are decoded on a small thread pool and handed to the Tk thread
+  through a queue, so picking hundreds of photos doesn't freeze the dialog
+- Only the rows in view (plus a little lookahead) exist as widgets; tiles
+  are recycled while scrolling
+- Selecting or removing an image only reconfigures the tiles it affects
+- PhotoImages live in a bounded LRU cache; a miss first tries the JPEG's
+  embedded EXIF thumbnail, then a reduced-size (draft) decode; very large
+  uncompressed TIFF / BMP files are read in bands (montage_tiles)
+- Decoded thumbnails are also kept in an on-disk store keyed by path, mtime
+  and size, so reopening the same folders doesn't decode anything
+"""
+
+import io
+import os
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import Canvas, Label, Button, PhotoImage, RIDGE, LEFT, RIGHT, BOTH, Y, VERTICAL
+from tkinter import ttk
+from PIL import Image, ImageTk, ExifTags
+
+import montage_cache
+import montage_tiles
+
+# ---------- Config ----------
+THUMB_SIZE = (80, 80)
+THUMB_PAD = 2            # gap between tiles
+THUMB_BORDER = 5         # relief + selection highlight around each thumbnail
+THUMB_WORKERS = min(4, os.cpu_count() or 1)
+LOOKAHEAD_ROWS = 2       # rows above/below the view decoded before they scroll in
+POLL_MS = 30
+MAX_PER_POLL = 24        # PhotoImages created per poll, keeps scrolling smooth
+THUMB_CACHE_ITEMS = 1000 # PhotoImages kept in memory (~25 KB each at 80x80)
+EXIF_ASPECT_TOLERANCE = 0.03  # reject letterboxed EXIF thumbnails
+THUMB_STORE = True       # keep decoded thumbnails on disk between sessions
+THUMB_STORE_DIR = os.path.join(montage_cache.CACHE_DIR, "thumbs")
+THUMB_STORE_MAX_MB = 128
+# ----------------------------
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_thumb_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=THUMB_WORKERS, thread_name_prefix="thumbs")
+            if THUMB_STORE:
+                _pool.submit(prune_thumb_store)
+        return _pool
+
+
+class ThumbnailCache:
+    """
+    path -> PhotoImage, least recently used dropped past max_items. Only
+    touched from the Tk thread. Tiles keep their own reference, so evicting
+    a thumbnail that's on screen doesn't blank it.
+    """
+    def __init__(self, max_items=THUMB_CACHE_ITEMS):
+        self.max_items = max_items
+        self._items = OrderedDict()
+
+    def get(self, path, default=None):
+        item = self._items.get(path)
+        if item is None:
+            return default
+        self._items.move_to_end(path)
+        return item
+
+    def __setitem__(self, path, photo):
+        self._items[path] = photo
+        self._items.move_to_end(path)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def __contains__(self, path):
+        return path in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+
+
+# ---------- Decoding (pool threads, no Tk calls) ----------
+def exif_thumbnail(pil_img, size=THUMB_SIZE):
+    """
+    The JPEG thumbnail embedded in EXIF IFD1, if it is at least `size` and
+    has the same aspect ratio as the image; otherwise None.
+    """
+    raw = pil_img.info.get("exif")
+    if not raw:
+        return None
+    try:
+        ifd1 = pil_img.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1.get(0x0201), ifd1.get(0x0202)  # JPEGInterchangeFormat(Length)
+        if not offset or not length:
+            return None
+        tiff = raw[6:] if raw.startswith(b"Exif\x00\x00") else raw
+        thumb = Image.open(io.BytesIO(tiff[offset:offset+length]))
+        thumb.load()
+    except Exception:
+        return None
+    if max(thumb.size) < max(size):
+        return None
+    img_ratio, thumb_ratio = pil_img.width / pil_img.height, thumb.width / thumb.height
+    if abs(thumb_ratio - img_ratio) > EXIF_ASPECT_TOLERANCE * img_ratio:
+        return None
+    return thumb
+
+
+def reduced_thumbnail(pil_img, size=THUMB_SIZE):
+    """
+    Decodes at the smallest JPEG DCT scale still >= 2x size (or box-reduces a
+    large uncompressed file while reading it), then resamples down.
+    """
+    factor = min(pil_img.width // (size[0]*2), pil_img.height // (size[1]*2))
+    if pil_img.width*pil_img.height >= montage_tiles.STREAM_MIN_PIXELS and factor >= 2 and montage_tiles.streamable(pil_img):
+        pil_img = montage_tiles.open_reduced(pil_img, factor)
+    else:
+        pil_img.draft(None, (size[0]*2, size[1]*2))
+        montage_tiles.check_pixels(pil_img.size)
+    pil_img.thumbnail(size)
+    return pil_img.copy()
+
+
+def store_path(img_path, size=THUMB_SIZE):
+    st = os.stat(img_path)
+    key = f"{os.path.abspath(img_path)}|{st.st_mtime_ns}|{st.st_size}|{size[0]}x{size[1]}"
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(THUMB_STORE_DIR, digest[:2], digest)
+
+
+def _store_load(base):
+    for ext in (".jpg", ".png"):
+        if os.path.exists(base + ext):
+            with Image.open(base + ext) as thumb:
+                thumb.load()
+                os.utime(base + ext)  # pruning drops the least recently used first
+                return thumb.copy()
+    return None
+
+
+def _store_save(base, thumb):
+    ext, fmt = (".jpg", "JPEG") if thumb.mode in ("RGB", "L") else (".png", "PNG")
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    tmp = f"{base}.{threading.get_ident()}.tmp"
+    thumb.save(tmp, fmt, quality=90)
+    os.replace(tmp, base + ext)
+
+
+def load_thumbnail(img_path, size=THUMB_SIZE, store=None):
+    """
+    PIL thumbnail of img_path: from the disk store, else the EXIF thumbnail,
+    else a reduced-size decode (saved to the store for next time).
+    """
+    store = THUMB_STORE if store is None else store
+    base = None
+    if store:
+        try:
+            base = store_path(img_path, size)
+            thumb = _store_load(base)
+            if thumb is not None:
+                return thumb
+        except OSError:
+            base = None
+
+    with montage_tiles.open_image(img_path) as pil_img:
+        thumb = exif_thumbnail(pil_img, size) if pil_img.format == "JPEG" else None
+        if thumb is not None:
+            thumb.thumbnail(size)
+        else:
+            thumb = reduced_thumbnail(pil_img, size)
+
+    if base:
+        try:
+            _store_save(base, thumb)
+        except OSError:
+            pass
+    return thumb
+
+
+def prune_thumb_store(max_mb=THUMB_STORE_MAX_MB):
+    """Deletes the least recently used stored thumbnails until the store is under max_mb."""
+    entries, total = [], 0
+    for root, _, files in os.walk(THUMB_STORE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    limit = max_mb * 2**20
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+class ThumbnailGrid(ttk.Frame):
+    def __init__(self, master, images, selected, cache, height=250):
+        """
+        images and selected (a set of indexes) are shared with the dialog and
+        edited in place; call refresh() after changing them from outside.
+        cache maps path -> PhotoImage and may outlive the grid.
+        """
+        super().__init__(master)
+        self.images = images
+        self.selected = selected
+        self.cache = cache
+        self.cell = THUMB_SIZE[0] + 2*THUMB_BORDER + 2*THUMB_PAD
+
+        self.canvas = Canvas(self, height=height, yscrollincrement=self.cell)
+        self.canvas.pack(side=LEFT, fill=BOTH, expand=True)
+        self.scrollbar = ttk.Scrollbar(self, orient=VERTICAL, command=self.canvas.yview)
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+        self.canvas.configure(yscrollcommand=self._on_view)
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+        self.canvas.bind("<Enter>", self._bind_mousewheel)
+        self.canvas.bind("<Leave>", self._unbind_mousewheel)
+        self.bind("<Destroy>", self._on_destroy)
+
+        self.placeholder = PhotoImage(master=self, width=THUMB_SIZE[0], height=THUMB_SIZE[1])
+        self.bg = self.canvas.cget("background")
+        self._tiles = {}        # position -> tile label on screen
+        self._free = []         # recycled tiles, parked out of view
+        self._futures = {}      # path -> decode future
+        self._failed = set()
+        self._results = queue.Queue()
+        self._scrollregion = None
+        self._layout_pending = False
+        self._polling = False
+        self._alive = True
+
+    # ---------- Public ----------
+    def refresh(self):
+        """Re-lays out the visible tiles on the next idle cycle."""
+        if self._alive and not self._layout_pending:
+            self._layout_pending = True
+            self.after_idle(self._layout)
+
+    def select(self, pos):
+        changed = set(self.selected) | {pos}
+        self.selected.clear()
+        self.selected.add(pos)
+        for p in changed:
+            if p in self._tiles:
+                self._style(self._tiles[p])
+
+    def remove(self, pos):
+        """Drops images[pos]; tiles after it shift back one slot on the next layout."""
+        if 0 <= pos < len(self.images):
+            self.images.pop(pos)
+        self.selected.clear()
+        self.refresh()
+
+    # ---------- Layout ----------
+    def _columns(self):
+        return max(1, self.canvas.winfo_width() // self.cell)
+
+    def _layout(self):
+        self._layout_pending = False
+        if not self._alive:
+            return
+        cols = self._columns()
+        rows = -(-len(self.images) // cols)
+        region = (0, 0, cols*self.cell, rows*self.cell)
+        if region != self._scrollregion:
+            self._scrollregion = region
+            self.canvas.configure(scrollregion=region)
+
+        top = self.canvas.canvasy(0)
+        first = max(0, int(top // self.cell))
+        last = min(rows, int((top + self.canvas.winfo_height()) // self.cell) + 1)
+        visible = range(first*cols, min(len(self.images), last*cols))
+
+        for pos in [p for p in self._tiles if p not in visible]:
+            self._park(self._tiles.pop(pos))
+        for pos in visible:
+            tile = self._tiles.get(pos)
+            if tile is None:
+                tile = self._tiles[pos] = self._free.pop() if self._free else self._new_tile()
+            self._show(tile, pos, cols)
+
+        ahead = range(max(0, first - LOOKAHEAD_ROWS)*cols, min(len(self.images), (last + LOOKAHEAD_ROWS)*cols))
+        self._request([self.images[p] for p in visible] + [self.images[p] for p in ahead if p not in visible])
+
+    def _new_tile(self):
+        tile = Label(self.canvas, image=self.placeholder, relief=RIDGE, borderwidth=2,
+                     highlightthickness=THUMB_BORDER-2, highlightbackground=self.bg, compound="center")
+        tile.pos = tile.path = None
+        tile.item = self.canvas.create_window(-self.cell, -self.cell, window=tile, anchor="nw")
+        tile.bind("<Button-1>", lambda e, t=tile: self.select(t.pos))
+        btn = Button(tile, text="✕", command=lambda t=tile: self.remove(t.pos))
+        btn.place(relx=1, rely=0, anchor="ne")
+        return tile
+
+    def _park(self, tile):
+        self.canvas.coords(tile.item, -self.cell, -self.cell)
+        tile.pos = None
+        self._free.append(tile)
+
+    def _show(self, tile, pos, cols):
+        self.canvas.coords(tile.item, (pos % cols)*self.cell + THUMB_PAD, (pos // cols)*self.cell + THUMB_PAD)
+        path = self.images[pos]
+        if tile.path != path:
+            tile.path = path
+            self._set_image(tile)
+        tile.pos = pos
+        self._style(tile)
+
+    def _set_image(self, tile):
+        tile.image = self.cache.get(tile.path) or self.placeholder  # keep a reference while shown
+        tile.config(image=tile.image, text="?" if tile.path in self._failed else "")
+
+    def _style(self, tile):
+        tile.config(highlightbackground="red" if tile.pos in self.selected else self.bg)
+
+    def _on_view(self, first, last):
+        self.scrollbar.set(first, last)
+        self.refresh()
+
+    # ---------- Background decoding ----------
+    def _request(self, paths):
+        wanted = set(paths)
+        for path, future in list(self._futures.items()):
+            if path not in wanted and future.cancel():
+                del self._futures[path]
+        pool = get_thumb_pool()
+        for path in paths:
+            if path in self._futures or path in self._failed or self.cache.get(path) is not None:
+                continue
+            future = pool.submit(load_thumbnail, path)
+            future.add_done_callback(lambda f, p=path: self._results.put((p, f)))
+            self._futures[path] = future
+        if self._futures and not self._polling:
+            self._polling = True
+            self.after(POLL_MS, self._poll)
+
+    def _poll(self):
+        if not self._alive:
+            return
+        for _ in range(MAX_PER_POLL):
+            try:
+                path, future = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if self._futures.get(path) is not future:
+                continue
+            del self._futures[path]
+            if future.cancelled():
+                continue
+            try:
+                self.cache[path] = ImageTk.PhotoImage(future.result())
+            except Exception:
+                self._failed.add(path)
+            for tile in self._tiles.values():
+                if tile.path == path:
+                    self._set_image(tile)
+        if self._futures or not self._results.empty():
+            self.after(POLL_MS, self._poll)
+        else:
+            self._polling = False
+
+    # ---------- Events ----------
+    def _bind_mousewheel(self, event):
+        if os.name == 'nt':          # Windows
+            self.canvas.bind_all("<MouseWheel>", lambda e: self.canvas.yview_scroll(int(-1*(e.delta/120)), "units"))
+        elif os.name == 'mac':       # macOS
+            self.canvas.bind_all("<MouseWheel>", lambda e: self.canvas.yview_scroll(int(-1*e.delta), "units"))
+        else:                        # Linux/others (X11)
+            self.canvas.bind_all("<Button-4>", lambda e: self.canvas.yview_scroll(-1, "units"))
+            self.canvas.bind_all("<Button-5>", lambda e: self.canvas.yview_scroll(1, "units"))
+
+    def _unbind_mousewheel(self, event):
+        # moving onto a tile also leaves the canvas; keep scrolling there
+        inside = self.winfo_containing(event.x_root, event.y_root)
+        if inside is not None and str(inside).startswith(str(self.canvas)):
+            return
+        try:
+            self.canvas.unbind_all("<MouseWheel>")
+            self.canvas.unbind_all("<Button-4>")
+            self.canvas.unbind_all("<Button-5>")
+        except Exception:
+            pass
+
+    def _on_destroy(self, event):
+        if event.widget is not self:
+            return
+        self._alive = False
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+montage_tiles.py
+
+Reduced-resolution loading for inputs too big to decode whole: scans and
+stitched panoramas stored as uncompressed TIFF, BMP or PPM/PGM, up to
+several gigapixels.
+
+- The file is memory-mapped and read in bands of rows (BAND_MB at a time,
+  across TIFF strip boundaries); each band is unpacked, converted to RGB and
+  box-reduced by an integer factor before the next one is read, so memory is
+  one band plus the reduced image, whatever the input size
+- The result is pixel-identical to Image.open(...).convert("RGB").reduce(factor)
+- Only uncompressed ("raw") data can be read this way. Pillow hands
+  compressed TIFFs to libtiff as one whole-image decode, so those (and PNG)
+  still load whole
+- open_image() also opens uncompressed files past Pillow's
+  decompression-bomb limit (they are only ever read reduced); callers that
+  then decode at full size call check_pixels() first
+"""
+
+import mmap
+import math
+from PIL import Image, BmpImagePlugin, PpmImagePlugin, TiffImagePlugin
+
+# ---------- Config ----------
+BAND_MB = 32  # raw bytes read (and unpacked) per band
+STREAM_MIN_PIXELS = 50_000_000  # callers read images this big in bands when they can
+# ----------------------------
+
+# Bits per pixel of the raw layouts Pillow's plugins report for uncompressed data
+RAW_BITS = {
+    "1": 1, "1;I": 1, "L": 8, "L;I": 8, "P": 8, "LA": 16, "I;16": 16, "I;16B": 16, "I;16L": 16, "I;16N": 16,
+    "RGB": 24, "BGR": 24, "RGBA": 32, "RGBX": 32, "RGBa": 32, "BGRA": 32, "BGRX": 32, "CMYK": 32,
+    "I": 32, "I;32": 32, "I;32B": 32, "F": 32, "F;32F": 32, "F;32BF": 32,
+}
+
+DROP_PAGES = hasattr(mmap, "MADV_DONTNEED")
+# Plugins whose uncompressed data open_reduced() can read
+RAW_PLUGINS = (TiffImagePlugin.TiffImageFile, BmpImagePlugin.BmpImageFile, PpmImagePlugin.PpmImageFile)
+
+
+def open_image(path):
+    """
+    Image.open, except that a file over the decompression-bomb limit is still
+    opened when open_reduced() can read it; the limit only guards decoding at
+    full size (see check_pixels()). Pillow's global limit is left alone.
+    """
+    try:
+        return Image.open(path)
+    except Image.DecompressionBombError:
+        for plugin in RAW_PLUGINS:
+            try:
+                pil_img = plugin(path)  # the plugin alone skips Image.open's size check
+            except (SyntaxError, OSError):
+                continue
+            if streamable(pil_img):
+                return pil_img
+            pil_img.close()
+        raise
+
+
+def check_pixels(size):
+    """Pillow's own limit for a full-size decode (twice MAX_IMAGE_PIXELS raises)."""
+    limit = Image.MAX_IMAGE_PIXELS
+    if limit and size[0] * size[1] > 2 * limit:
+        raise Image.DecompressionBombError(
+            f"Image size ({size[0] * size[1]} pixels) exceeds limit of {2 * limit} pixels; "
+            "only uncompressed TIFF, BMP and PPM can be loaded reduced")
+
+
+def _row_runs(pil_img):
+    """
+    The raw layout of pil_img as (rawmode, stride, ystep, runs), runs being
+    (first row, last row + 1, file offset) per strip, or None if it isn't
+    plain uncompressed full-width strips.
+    """
+    if not getattr(pil_img, "filename", None) or not pil_img.tile:
+        return None
+    width = pil_img.width
+    layout, runs = None, []
+    for tile in pil_img.tile:
+        codec, extents, offset, args = tile
+        if codec != "raw":
+            return None
+        args = (args,) if isinstance(args, str) else tuple(args)
+        rawmode, stride, ystep = (args + (0, 1))[:3]
+        x0, y0, x1, y1 = extents
+        if x0 != 0 or x1 != width or rawmode not in RAW_BITS:
+            return None
+        stride = stride or math.ceil(width * RAW_BITS[rawmode] / 8)
+        if layout is None:
+            layout = (rawmode, stride, ystep)
+        elif layout != (rawmode, stride, ystep):
+            return None
+        runs.append((y0, y1, offset))
+    rawmode, stride, ystep = layout
+    if ystep not in (1, -1) or (ystep == -1 and len(runs) > 1):
+        return None
+    runs.sort()
+    if runs[0][0] != 0 or runs[-1][1] != pil_img.height or any(a[1] != b[0] for a, b in zip(runs, runs[1:])):
+        return None
+    return rawmode, stride, ystep, runs
+
+
+def streamable(pil_img):
+    """True if open_reduced() can read pil_img (an unloaded Image.open result) band by band."""
+    return _row_runs(pil_img) is not None
+
+
+def open_reduced(pil_img, factor):
+    """
+    pil_img (unloaded, see streamable()) as RGB, box-reduced by the integer
+    `factor`, reading the file a band of rows at a time.
+    """
+    rawmode, stride, ystep, runs = _row_runs(pil_img)
+    width, height = pil_img.size
+    palette = pil_img.getpalette() if pil_img.mode == "P" else None
+    band_rows = factor * max(1, int(BAND_MB * 2**20) // stride // factor)
+    out = Image.new("RGB", (math.ceil(width / factor), math.ceil(height / factor)))
+    with open(pil_img.filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for top in range(0, height, band_rows):
+            bottom = min(height, top + band_rows)
+            if ystep == -1:
+                # bottom-up rows (BMP): the band is stored last row first
+                (y0, y1, offset), = runs
+                start = offset + (y1 - bottom) * stride
+                raw = data[start:start + (bottom - top) * stride]
+            else:
+                raw = b"".join(data[offset + (max(top, y0) - y0) * stride:offset + (min(bottom, y1) - y0) * stride]
+                               for y0, y1, offset in runs if y0 < bottom and y1 > top)
+            band = Image.frombuffer(pil_img.mode, (width, bottom - top), raw, "raw", rawmode, stride, ystep)
+            if palette:
+                band.putpalette(palette)
+            out.paste(band.convert("RGB").reduce(factor), (0, top // factor))
+            del band, raw
+            if DROP_PAGES:
+                data.madvise(mmap.MADV_DONTNEED)  # read pages would otherwise stay in this process's RSS
+    return out
@@ -0,0 +1,12 @@
+import pytest
+from PIL import Image
+
+import montage_engine as engine
+
+
+@pytest.mark.parametrize("bbox", [(0, 5999.994, 4000, 5999.994), (0, 6000.0, 4000, 6000.0)])
+def test_rotated_crop_reaching_far_edge(bbox):
+    # upright 4000x6000 (a turned 6000x4000 landscape); the crop window ends on the last row
+    cell_w, cell_h = engine.page_layout(engine.PAGE_SIZES["Letter"], 3, 3).cell_size(0)
+    cell = engine.place_image_in_cell(Image.new("RGB", (6000, 4000), "gray"), cell_w, cell_h, bbox=bbox)
+    assert cell.size == (cell_w, cell_h)